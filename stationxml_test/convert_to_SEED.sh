@@ -1,17 +1,21 @@
 #!/usr/bin/env bash
 # -*- coding: utf-8 -*-
 #
-# Converts all StationXML files to SEED files.
+# Converts all StationXML files to SEED files. gzip compressed StationXML
+# files are decompressed on the fly.
 
 folder="SEED/"
 extension=".seed"
 converter="~/Downloads/stationxml-converter-1.0.1.jar"
 
-for i in StationXML/*.xml
+for i in StationXML/*.xml StationXML/*.xml.gz
     do
+        # Unmatched patterns.
+        [ -f "$i" ] || continue
+
         name=`echo $i | cut -d'/' -f2`
 
-        filename=$(basename "$name")
+        filename=$(basename "$name" .gz)
         filename="${filename%.*}"
 
         name=$folder$filename$extension
@@ -19,7 +23,12 @@ for i in StationXML/*.xml
         if [ ! -f $name ]
         then
             echo "Converting " $i
-            java -jar $converter -s $i > $name
+            if [[ $i == *.gz ]]
+            then
+                java -jar $converter -s <(gunzip -c $i) > $name
+            else
+                java -jar $converter -s $i > $name
+            fi
         fi
 
     done
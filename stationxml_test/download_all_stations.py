@@ -10,13 +10,25 @@ Downloads the response level StationXML file for all stations in the file
     GNU Lesser General Public License, Version 3
     (http://www.gnu.org/copyleft/lesser.html)
 """
+import collections
 import colorama
+import copy
+import gzip
+from lxml import etree
 from obspy.station import read_inventory
 from obspy.fdsn import Client
 import os
+from StringIO import StringIO
 
 output_dir = "StationXML"
 
+# Number of stations requested with a single bulk request.
+bulk_size = 50
+
+# Write gzip compressed StationXML files. test_response_large_scale.py reads
+# compressed and uncompressed files.
+compress = False
+
 c = Client()
 
 inv = read_inventory("./all_stations.xml")
@@ -30,20 +42,91 @@ def print_ok(msg):
     print colorama.Fore.GREEN + msg + colorama.Fore.RESET
 
 
+def copy_without_children(element, tag):
+    """
+    Deep copy of an element without its `tag` children.
+    """
+    new = etree.Element(element.tag, attrib=element.attrib,
+                        nsmap=element.nsmap)
+    new.text = element.text
+    new.extend(copy.deepcopy(_i) for _i in element if _i.tag != tag)
+    return new
+
+
+def split_stationxml(data):
+    """
+    Split a StationXML document into one document per station.
+
+    Works on the raw XML so the files are exactly what the server returned -
+    they are used to test ObsPy's StationXML reader so they must not be
+    read and written with it. Each document has the root element and the
+    network elements with all their children, but only the station elements
+    (all epochs) of a single station.
+
+    Returns a dictionary mapping (network, station) to the documents.
+    """
+    root = etree.fromstring(data)
+    namespace = etree.QName(root).namespace
+    network_tag = "{%s}Network" % namespace if namespace else "Network"
+    station_tag = "{%s}Station" % namespace if namespace else "Station"
+
+    stations = collections.defaultdict(list)
+    for network in root.iterchildren(network_tag):
+        by_code = collections.defaultdict(list)
+        for station in network.iterchildren(station_tag):
+            by_code[station.get("code")].append(station)
+        for code, elements in by_code.items():
+            stations[(network.get("code"), code)].append((network, elements))
+
+    documents = {}
+    for key, networks in stations.items():
+        new_root = copy_without_children(root, network_tag)
+        for network, elements in networks:
+            new_network = copy_without_children(network, station_tag)
+            new_network.extend(copy.deepcopy(_i) for _i in elements)
+            new_root.append(new_network)
+        documents[key] = etree.tostring(new_root, xml_declaration=True,
+                                        encoding="UTF-8")
+    return documents
+
+
+# Collect all stations that still have to be downloaded.
+stations = []
+seen = set()
 for network in inv.networks:
     for station in network.stations:
         output_filename = os.path.join(output_dir, "%s.%s.xml" %
                                        (network.code, station.code))
-        if os.path.exists(output_filename):
+        if compress:
+            output_filename += ".gz"
+        # Skip existing files and further epochs of the same station.
+        if os.path.exists(output_filename) or output_filename in seen:
             continue
+        seen.add(output_filename)
+        stations.append((network.code, station.code, output_filename))
 
-        try:
-            out = c.get_stations(network=network.code, station=station.code,
-                                 level="response")
-        except:
-            print_error("Failed to download %s.%s." % (network.code,
-                                                       station.code))
+# Download them in bulk requests and split them into one file per station.
+for _i in xrange(0, len(stations), bulk_size):
+    batch = stations[_i:_i + bulk_size]
+    # Keep the raw StationXML of the server.
+    buf = StringIO()
+    try:
+        c.get_stations_bulk(
+            [(net, sta, "*", "*", "*", "*") for net, sta, _ in batch],
+            level="response", filename=buf)
+        documents = split_stationxml(buf.getvalue())
+    except:
+        print_error("Failed to download %i stations starting with %s.%s." %
+                    ((len(batch), ) + batch[0][:2]))
+        continue
+    for net, sta, output_filename in batch:
+        if (net, sta) not in documents:
+            print_error("Failed to download %s.%s." % (net, sta))
             continue
-        with open(output_filename, "w") as fh:
-            fh.write(out)
-        print_ok("Downloaded %s.%s." % (network.code, station.code))
+        if compress:
+            with gzip.open(output_filename, "wb") as fh:
+                fh.write(documents[(net, sta)])
+        else:
+            with open(output_filename, "wb") as fh:
+                fh.write(documents[(net, sta)])
+        print_ok("Downloaded %s.%s." % (net, sta))
@@ -1,60 +1,115 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-Separate process to test for evalresp segfaults which otherwise interrupt the
+Separate process to run evalresp in so its segfaults do not interrupt the
 current Python process.
 
+The worker process is started once and then evaluates any number of
+responses. If it dies, the crash is reported as the result of that call and
+a new worker is started for the next one.
+
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2014
 :license:
     GNU Lesser General Public License, Version 3
     (http://www.gnu.org/copyleft/lesser.html)
 """
-from multiprocessing import Process
-from obspy.signal.invsim import evalresp
+from multiprocessing import Pipe, Process
+from StringIO import StringIO
 
 from obspy.core.util.misc import CatchOutput
 
-import sys
+from frequency_subset import evalresp_subset
+
+
+def _evaluate(t_samp, nfft, resp, date, stat_id, chan_id, net_id, loc_id,
+              units, n_bins):
+    out = None
+    try:
+        with CatchOutput() as out:
+            response, freq = evalresp_subset(
+                t_samp, nfft, StringIO(resp), date=date, station=stat_id,
+                channel=chan_id, network=net_id, locid=loc_id, units=units,
+                n_bins=n_bins)
+    except Exception as e:
+        stderr = out.stderr if out else ""
+        if stderr and "are not supported" in stderr:
+            return "uniterror", None, stderr
+        return "error", str(e) or "Failed to calculate response", stderr
+    return "ok", (response, freq), out.stderr
+
+
+def _worker(conn):
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+        # Sent when closing the worker.
+        if args is None:
+            break
+        conn.send(_evaluate(*args))
+
 
+class EvalrespWorker(object):
+    """
+    Long-lived worker process evaluating RESP files with evalresp.
+    """
+    def __init__(self):
+        self._process = None
+        self._conn = None
+        self.crashes = 0
+
+    def _start(self):
+        self._conn, child_conn = Pipe()
+        self._process = Process(target=_worker, args=(child_conn,))
+        self._process.daemon = True
+        self._process.start()
+        # Only the worker must hold this end so a dying worker closes the
+        # pipe.
+        child_conn.close()
+
+    def evaluate(self, t_samp, nfft, filename, date, stat_id, chan_id,
+                 net_id, loc_id, units, n_bins=None):
+        """
+        Evaluate the response of a channel in a RESP file at the first
+        `n_bins` frequencies of the FFT frequency grid (all if None).
+
+        Returns a tuple of the status, the value, and the stderr output of
+        evalresp. The status is one of
+
+        * ``"ok"``: The value is a tuple of the response and the frequencies.
+        * ``"uniterror"``: The units are not supported by evalresp.
+        * ``"error"``: The value is the error message.
+        * ``"segfault"``: The worker died. The value is its exit code.
+        """
+        if self._process is None or not self._process.is_alive():
+            self._start()
+
+        filename.seek(0, 0)
+        resp = filename.read()
+        filename.seek(0, 0)
+
+        try:
+            self._conn.send((t_samp, nfft, resp, date, stat_id, chan_id,
+                             net_id, loc_id, units, n_bins))
+            return self._conn.recv()
+        except (EOFError, IOError):
+            # The worker died - most likely evalresp segfaulted.
+            self._process.join()
+            exitcode = self._process.exitcode
+            self._conn.close()
+            self._process = None
+            self.crashes += 1
+            return "segfault", exitcode, ""
 
-def test_evalresp_segfault(t_samp, filename, date, stat_id, chan_id, net_id,
-                           loc_id, units):
-        out = None
+    def close(self):
+        if self._process is None:
+            return
         try:
-            with CatchOutput() as out:
-                evalresp(
-                    t_samp, 5, filename, date=date, station=stat_id,
-                    channel=chan_id, network=net_id, locid=loc_id,
-                    units=units, freq=True)
-        except:
-            if out and out.stderr and "are not supported" in out.stderr:
-                sys.exit(99)
-            else:
-                sys.exit(1)
-
-
-def test_for_segfault(t_samp, filename, date, stat_id, chan_id, net_id, loc_id,
-                      units):
-
-    p = Process(target=test_evalresp_segfault,
-                args=(t_samp, filename, date, stat_id, chan_id, net_id,
-                      loc_id, units))
-    p.start()
-    p.join()
-
-    p.terminate()
-    p.terminate()
-    p.terminate()
-
-    exitcode = p.exitcode
-    filename.seek(0, 0)
-
-    if exitcode and exitcode not in [1, 99]:
-        return "segfault"
-    elif exitcode == 1:
-        return "Failed to calculate response"
-    elif exitcode == 99:
-        return "uniterror"
-    else:
-        return None
+            self._conn.send(None)
+        except IOError:
+            pass
+        self._process.join()
+        self._conn.close()
+        self._process = None
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Evaluate responses only in the low band of an FFT frequency grid.
+
+`evalresp()` and `Response.get_evalresp_response()` always evaluate all
+``nfft // 2 + 1`` frequencies up to the Nyquist frequency. The functions here
+return the same frequency vector but only its first `n_bins` entries (or the
+ones up to `max_frequency`) and only evaluate these.
+
+ObsPy versions without the ``*_for_frequencies()`` functions evaluate the
+full grid which is cut afterwards so the results are always the same.
+"""
+import numpy as np
+
+from obspy.signal import invsim
+
+
+def get_fft_frequencies(t_samp, nfft, n_bins=None, max_frequency=None):
+    """
+    Get the frequencies evalresp evaluates a response at for an FFT of
+    length `nfft` of data sampled every `t_samp` seconds, limited to the
+    first `n_bins` frequencies and/or all frequencies up to
+    `max_frequency`.
+    """
+    freqs = np.linspace(0, 1.0 / (t_samp * 2.0), nfft // 2 + 1)
+    if max_frequency is not None:
+        freqs = freqs[freqs <= max_frequency]
+    return freqs[:n_bins]
+
+
+def evalresp_subset(t_samp, nfft, filename, date, station="*", channel="*",
+                    network="*", locid="*", units="VEL", n_bins=None,
+                    max_frequency=None):
+    """
+    Same as `obspy.signal.invsim.evalresp(..., freq=True)` but only evaluates
+    the first `n_bins` frequencies and/or the ones up to `max_frequency`.
+
+    Returns the response and the frequencies.
+    """
+    freqs = get_fft_frequencies(t_samp, nfft, n_bins, max_frequency)
+    if hasattr(invsim, "evalresp_for_frequencies"):
+        response = invsim.evalresp_for_frequencies(
+            t_samp, freqs, filename, date, station=station, channel=channel,
+            network=network, locid=locid, units=units)
+        return response, freqs
+    response, _ = invsim.evalresp(
+        t_samp, nfft, filename, date=date, station=station, channel=channel,
+        network=network, locid=locid, units=units, freq=True)
+    return response[:len(freqs)], freqs
+
+
+def get_evalresp_response_subset(response, t_samp, nfft, output="VEL",
+                                 n_bins=None, max_frequency=None):
+    """
+    Same as `Response.get_evalresp_response()` but only evaluates the first
+    `n_bins` frequencies and/or the ones up to `max_frequency`.
+
+    Returns the response and the frequencies.
+    """
+    freqs = get_fft_frequencies(t_samp, nfft, n_bins, max_frequency)
+    if hasattr(response, "get_evalresp_response_for_frequencies"):
+        values = response.get_evalresp_response_for_frequencies(
+            freqs, output=output)
+        return values, freqs
+    values, _ = response.get_evalresp_response(t_samp, nfft, output=output)
+    return values[:len(freqs)], freqs
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reproducible sampling of the StationXML files to test.
+
+Files are drawn without replacement and stratified by network and by the
+types of response stages they contain so that a small sample still covers
+all kinds of responses. The sample only depends on the seed so it can be
+split into disjoint shards that are tested on different machines.
+"""
+import argparse
+import collections
+import gzip
+import os
+import random
+import re
+
+
+# StationXML elements of the different response stage types.
+STAGE_TYPES = ("PolesZeros", "Coefficients", "FIR", "ResponseList",
+               "Polynomial")
+
+_STAGE_TYPE_PATTERN = re.compile(r"<(?:\w+:)?(%s)\b" % "|".join(STAGE_TYPES))
+
+
+def get_network(filename):
+    """
+    Get the network code from a ``NET.STA.xml`` filename.
+    """
+    return os.path.basename(filename).split(".")[0]
+
+
+def get_stage_types(filename):
+    """
+    Get the sorted names of all types of response stages in a possibly gzip
+    compressed StationXML file. Scans the raw text so it is much faster
+    than parsing the file.
+    """
+    if filename.endswith(".gz"):
+        with gzip.open(filename, "rb") as fh:
+            data = fh.read()
+    else:
+        with open(filename, "rb") as fh:
+            data = fh.read()
+    return tuple(sorted(set(_STAGE_TYPE_PATTERN.findall(data))))
+
+
+def get_stratum(filename, by_stage_types=True):
+    if by_stage_types:
+        return get_network(filename), get_stage_types(filename)
+    return get_network(filename), ()
+
+
+def stratified_sample(filenames, n, seed, by_stage_types=True):
+    """
+    Draw `n` files without replacement, stratified by network and (optionally)
+    the types of response stages.
+
+    Every stratum gets at least one file (as long as there are more files to
+    draw than strata) and the rest is distributed proportionally to the size
+    of the strata. The sample is shuffled and only depends on the seed and
+    the set of filenames.
+    """
+    rng = random.Random(seed)
+    filenames = sorted(filenames)
+    if n is None or n >= len(filenames):
+        rng.shuffle(filenames)
+        return filenames
+
+    strata = collections.defaultdict(list)
+    for filename in filenames:
+        strata[get_stratum(filename, by_stage_types)].append(filename)
+    keys = sorted(strata)
+
+    # At least one per stratum if possible, the remainder with the largest
+    # remainder method.
+    if n >= len(keys):
+        counts = dict((_i, 1) for _i in keys)
+    else:
+        counts = dict((_i, 0) for _i in keys)
+        for key in rng.sample(keys, n):
+            counts[key] = 1
+    remaining = n - sum(counts.values())
+    available = len(filenames) - sum(counts.values())
+    if remaining and available:
+        shares = dict(
+            (_i, float(remaining) * (len(strata[_i]) - counts[_i]) / available)
+            for _i in keys)
+        for key in keys:
+            counts[key] += int(shares[key])
+        remaining = n - sum(counts.values())
+        for key in sorted(keys, key=lambda x: shares[x] - int(shares[x]),
+                          reverse=True)[:remaining]:
+            counts[key] += 1
+
+    sample = []
+    for key in keys:
+        sample.extend(rng.sample(strata[key], counts[key]))
+    rng.shuffle(sample)
+    return sample
+
+
+def get_shard(items, shard):
+    """
+    Get the `i`-th of `N` disjoint shards of a list for a ``(i, N)`` tuple
+    with ``1 <= i <= N``.
+    """
+    index, count = shard
+    return items[index - 1::count]
+
+
+def shard_type(value):
+    """
+    argparse type for ``i/N`` shard specifications.
+    """
+    try:
+        index, count = [int(_i) for _i in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Shard must be given as 'i/N', e.g. '1/4'.")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            "Shard index must be between 1 and the number of shards.")
+    return index, count
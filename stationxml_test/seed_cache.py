@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cache of parsed SEED files and their RESP files.
+
+Parsing a SEED file and converting it to RESP files is by far the most
+expensive part of testing a channel and it is the same for all channels of a
+station. The last few SEED files are thus kept in memory together with an
+index of the blockettes of every channel and the content of all of their RESP
+files. The RESP files are only created once they are needed so channels can
+be skipped based on their blockettes before that.
+"""
+import collections
+import os
+from StringIO import StringIO
+import sys
+import warnings
+
+from obspy.xseed import Parser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "the_great_response_test"))
+from lru_cache import LRUCache
+
+
+# Dictionary blockettes and the response blockettes they replace when they
+# are referenced by a response reference blockette 60.
+DICTIONARY_BLOCKETTES = {41: 61, 42: 62, 43: 53, 44: 54, 45: 55, 46: 56,
+                         47: 57, 48: 58}
+
+# Blockettes of a channel that end up in its RESP file.
+RESP_BLOCKETTES = (50, 52, 53, 54, 55, 56, 57, 58, 61, 62)
+
+
+class SEEDReadError(Exception):
+    pass
+
+
+class RESPError(Exception):
+    pass
+
+
+def get_blockette_index(parser):
+    """
+    Get the ids of the blockettes of every channel epoch of a parsed SEED
+    file without creating any RESP files.
+
+    Returns a dictionary mapping the RESP file name of every channel
+    (``RESP.NET.STA.LOC.CHA``) to a list of ``(start_date, end_date,
+    blockette_ids)`` tuples, one per epoch. Dictionary blockettes referenced
+    by blockette 60 are counted as the response blockettes they stand for,
+    e.g. 43 as 53. The ids thus describe the stages of the channel and are
+    not necessarily those in its RESP file - ObsPy's RESP writer keeps
+    blockettes 41 to 48 and 60.
+    """
+    lookup = {}
+    for blkt in parser.abbreviations:
+        if blkt.id in DICTIONARY_BLOCKETTES:
+            lookup[blkt.response_lookup_key] = DICTIONARY_BLOCKETTES[blkt.id]
+
+    index = collections.defaultdict(list)
+    for station in parser.stations:
+        network = station_code = None
+        blockettes = None
+        for blkt in station:
+            if blkt.id == 50:
+                network = blkt.network_code.strip()
+                station_code = blkt.station_call_letters.strip()
+                blockettes = None
+            elif blkt.id == 52:
+                blockettes = set([50, 52])
+                name = "RESP.%s.%s.%s.%s" % (
+                    network, station_code, blkt.location_identifier.strip(),
+                    blkt.channel_identifier.strip())
+                index[name].append((blkt.start_date, blkt.end_date,
+                                    blockettes))
+            # Station blockettes before the first channel.
+            elif blockettes is None:
+                continue
+            elif blkt.id == 60:
+                for stage in blkt.stages:
+                    blockettes.update(lookup[_i] for _i in stage
+                                      if _i in lookup)
+            elif blkt.id in RESP_BLOCKETTES:
+                blockettes.add(blkt.id)
+    return dict(index)
+
+
+class _SEEDFile(object):
+    def __init__(self, parser):
+        self.parser = parser
+        self.blockette_index = get_blockette_index(parser)
+        # Content of all RESP files by their name - created on demand.
+        self.resps = None
+
+
+class SEEDCache(LRUCache):
+    """
+    Least recently used cache of the last `maxsize` parsed SEED files.
+
+    Failures are cached as well and raised again for every channel of the
+    file.
+    """
+    def __init__(self, maxsize=10):
+        super(SEEDCache, self).__init__(maxsize)
+
+    def _load(self, seed_file):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            try:
+                return _SEEDFile(Parser(seed_file))
+            except Exception as e:
+                raise SEEDReadError(str(e))
+
+    def _get(self, seed_file):
+        return self.get(seed_file, lambda: self._load(seed_file))
+
+    def get_parser(self, seed_file):
+        """
+        Get the parser of a SEED file. Raises a SEEDReadError if it cannot be
+        read.
+        """
+        return self._get(seed_file).parser
+
+    def get_blockettes(self, seed_file, resp_name):
+        """
+        Get the ids of all blockettes of all epochs of the channel with the
+        given RESP file name.
+        """
+        blockettes = set()
+        for _, _, _i in self._get(seed_file).blockette_index.get(resp_name,
+                                                                  []):
+            blockettes.update(_i)
+        return blockettes
+
+    def get_resp_files(self, seed_file, resp_name):
+        """
+        Get a new file-like object for each RESP file with the given name of
+        a SEED file.
+
+        Raises a RESPError if the file cannot be converted to RESP files.
+        """
+        seed = self._get(seed_file)
+        if seed.resps is None:
+            try:
+                all_resps = seed.parser.getRESP()
+            except Exception as e:
+                seed.resps = RESPError(str(e))
+            else:
+                # Names could in theory appear more than once.
+                seed.resps = collections.defaultdict(list)
+                for name, fh in all_resps:
+                    fh.seek(0, 0)
+                    seed.resps[name].append(fh.read())
+                seed.resps = dict(seed.resps)
+        if isinstance(seed.resps, Exception):
+            raise seed.resps
+        return [StringIO(_i) for _i in seed.resps.get(resp_name, [])]
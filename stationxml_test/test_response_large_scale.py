@@ -12,20 +12,22 @@ Test suite for the StationXML responses.
 #import faulthandler
 #faulthandler.enable()
 
+import argparse
 import collections
 import colorama
 import fnmatch
 import glob
+import gzip
 import numpy as np
 from obspy.core.util.misc import CatchOutput
-from obspy.signal.invsim import evalresp
 from obspy.station import read_inventory
-from obspy.xseed import Parser
 import os
-import random
 import warnings
 
-from evresp_process import test_for_segfault
+from evresp_process import EvalrespWorker
+from frequency_subset import get_evalresp_response_subset
+from sampling import get_shard, shard_type, stratified_sample
+from seed_cache import RESPError, SEEDCache, SEEDReadError
 
 #channel_filter = []
 #station_pattern = "IU.TUC"
@@ -40,8 +42,13 @@ exclude_station_patterns = "EM.*"
 
 debug = False
 
+# Test a random sample of `limit` files. It is drawn without replacement,
+# stratified by network and (optionally) by the types of response stages,
+# and only depends on the seed.
 randomize = True
 limit = 1000
+random_seed = 12345
+stratify_by_stage_types = True
 
 if station_pattern:
     randomize = False
@@ -62,6 +69,11 @@ seed = "SEED/"
 
 t_samp = 10.0
 nfft = 16384
+# Only the first bins of the FFT frequency grid are evaluated and compared.
+# Oftentimes numerically unstable FIR filters manifest most strongly in high
+# frequencies. And StationXML and RESP store numbers in a slightly different
+# way and thus rounding errors occur. Set to None to compare all bins.
+n_bins = 1000
 units = ["DISP", "ACC", "VEL"]
 
 
@@ -81,7 +93,41 @@ def print_good(msg):
     print colorama.Fore.GREEN + msg + colorama.Fore.RESET
 
 
-station_files = glob.glob(os.path.join(stationxml, "*.xml"))
+arg_parser = argparse.ArgumentParser(
+    description="Compare the StationXML responses to the SEED responses.")
+arg_parser.add_argument(
+    "--shard", type=shard_type, default=(1, 1),
+    help="Only test the i-th of N disjoint parts of the sample, given as "
+    "'i/N'. Use the same seed on all machines to cover the whole sample.")
+arg_parser.add_argument("--seed", type=int, default=random_seed,
+                        help="Seed of the random sample.")
+arg_parser.add_argument("--limit", type=int, default=limit,
+                        help="Number of files to test, 0 for all.")
+args = arg_parser.parse_args()
+
+
+def _is_selected(xml_file):
+    station_name = os.path.basename(xml_file).split(".xml")[0]
+    if station_pattern and not fnmatch.fnmatch(station_name, station_pattern):
+        return False
+    if exclude_station_patterns and \
+            fnmatch.fnmatch(station_name, exclude_station_patterns):
+        return False
+    return True
+
+
+# Uncompressed and gzip compressed StationXML files.
+station_files = sorted(glob.glob(os.path.join(stationxml, "*.xml")) +
+                       glob.glob(os.path.join(stationxml, "*.xml.gz")))
+station_files = [_i for _i in station_files if _is_selected(_i)]
+
+if randomize:
+    station_files = stratified_sample(
+        station_files, args.limit or None, args.seed,
+        by_stage_types=stratify_by_stage_types)
+elif args.limit:
+    station_files = station_files[:args.limit]
+station_files = get_shard(station_files, args.shard)
 
 
 counter = collections.Counter(
@@ -101,38 +147,32 @@ counter = collections.Counter(
 
 faulty_seed_files = []
 
-# Loop over all StationXML files.
-for _i in xrange(len(station_files)):
-    if limit and _i >= limit:
-        break
+# The SEED file of a station is only parsed and converted to RESP files once
+# for all of its channels.
+seed_cache = SEEDCache(maxsize=10)
 
-    if randomize:
-        xml_file = random.choice(station_files)
-    else:
-        xml_file = station_files[_i]
+# evalresp runs in a separate, long-lived process so it can't crash this one.
+evalresp_worker = EvalrespWorker()
 
-    station_name = os.path.basename(xml_file).replace(".xml", "")
-
-    if station_pattern and not fnmatch.fnmatch(station_name, station_pattern):
-        continue
-
-    if exclude_station_patterns and \
-            fnmatch.fnmatch(station_name, exclude_station_patterns):
-        continue
+# Loop over all selected StationXML files.
+for _i, xml_file in enumerate(station_files):
+    station_name = os.path.basename(xml_file).split(".xml")[0]
 
     print "File %i of %i (%s)..." % (_i + 1, len(station_files), xml_file)
 
     # Find the corresponding SEED file.
-    seed_file = os.path.join(
-        seed,
-        os.path.splitext(
-            os.path.basename(xml_file))[0] + os.path.extsep + "seed")
+    seed_file = os.path.join(seed, station_name + os.path.extsep + "seed")
     if not os.path.exists(seed_file):
         msg = "Could not find SEED file '%s'. Will be skipped" % seed_file
         print_warning(msg)
         continue
 
-    inv = read_inventory(xml_file, format="stationxml")
+    # Compressed files are decompressed on the fly.
+    if xml_file.endswith(".gz"):
+        with gzip.open(xml_file, "rb") as fh:
+            inv = read_inventory(fh, format="stationxml")
+    else:
+        inv = read_inventory(xml_file, format="stationxml")
     net_id = inv[0].code
     stat_id = inv[0][0].code
 
@@ -172,91 +212,68 @@ for _i in xrange(len(station_files)):
 
         unit_known_to_evalresp = True
 
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            try:
-                p = Parser(seed_file)
-            except:
-                faulty_seed_files.append(seed_file)
-                counter["random_error"] += 1
-                print_warning("Failed to read SEED file!")
-                continue
+        resp_string = "RESP.%s.%s.%s.%s" % (net_id, stat_id, loc_id, chan_id)
+        try:
+            # All blockettes of the channel - known from parsing the SEED
+            # file without creating any RESP files.
+            blkts = seed_cache.get_blockettes(seed_file, resp_string)
+        except SEEDReadError:
+            faulty_seed_files.append(seed_file)
+            counter["random_error"] += 1
+            print_warning("Failed to read SEED file!")
+            continue
+
+        if 62 in blkts:
+            print_info("Polynomial response found. "
+                       "Evalresp cannot deal with it")
+            counter["polynomial_response"] += len(units)
+            continue
 
         try:
-            all_resps = p.getRESP()
-        except:
+            all_resps = seed_cache.get_resp_files(seed_file, resp_string)
+        except RESPError:
             counter["random_error"] += 1
             print_warning("getRESP() failed. Very likely a faulty SEED file")
             continue
-        resp_string = "RESP.%s.%s.%s.%s" % (net_id, stat_id, loc_id, chan_id)
-        all_resps = [_i for _i in all_resps if _i[0] == resp_string]
 
         if len(all_resps) != 1:
             msg = "Something fishy going on..."
             print_error(msg)
             break
 
-        filename = all_resps[0][-1]
+        filename = all_resps[0]
 
         for unit in units:
             filename.seek(0, 0)
 
-            out = None
+            evalresp_stderr = None
             seedresp_error = None
 
-            # Get a set of all blockettes.
-            blkts = set([int(i[1:4]) for i in filename.readlines()
-                         if len(i) >= 4 and i[1:4].isdigit()])
             if blkts == set([50, 52, 58]):
                 seedresp_error = "Not enough blockettes available"
                 if debug:
                     print seedresp_error
-            else:
-                filename.seek(0, 0)
-
-            if 62 in blkts:
-                print_info("Polynomial response found. "
-                           "Evalresp cannot deal with it")
-                counter["polynomial_response"] += 1
-                continue
 
             # Calculate the response by converting the SEED to RESP files and
             # passing those to evalresp.
             if not seedresp_error:
-                output = test_for_segfault(t_samp, filename, date, stat_id,
-                                           chan_id, net_id, loc_id, unit)
-                if output == "segfault":
+                status, value, evalresp_stderr = evalresp_worker.evaluate(
+                    t_samp, nfft, filename, date, stat_id, chan_id, net_id,
+                    loc_id, unit, n_bins=n_bins)
+                if debug:
+                    print "SEED"
+                    print evalresp_stderr
+                if status == "segfault":
                     print_info("Raw evalresp segfaults. XML response not "
                                "attempted.")
                     counter["evalresp_segfaults"] += 1
                     continue
-                elif not output:
-                    filename.seek(0, 0)
-
-                    if debug:
-                        print "SEED"
-                        try:
-                            seed_response, seed_freq = evalresp(
-                                t_samp, nfft, filename, date=date,
-                                station=stat_id, channel=chan_id,
-                                network=net_id, locid=loc_id, units=unit,
-                                freq=True)
-                        except ValueError as e:
-                            seedresp_error = e
-                    else:
-                        with CatchOutput() as out:
-                            try:
-                                seed_response, seed_freq = evalresp(
-                                    t_samp, nfft, filename, date=date,
-                                    station=stat_id, channel=chan_id,
-                                    network=net_id, locid=loc_id, units=unit,
-                                    freq=True)
-                            except ValueError as e:
-                                seedresp_error = e
-                elif output == "uniterror":
+                elif status == "ok":
+                    seed_response, seed_freq = value
+                elif status == "uniterror":
                     unit_known_to_evalresp = False
                 else:
-                    seedresp_error = output
+                    seedresp_error = value
 
             # Calculate the response by directly passing values from ObsPy to
             # evalresp.
@@ -269,8 +286,9 @@ for _i in xrange(len(station_files)):
                     try:
                         with CatchOutput() as other_out:
                             xml_response, xml_freq = \
-                                channel.response.get_evalresp_response(
-                                    t_samp, nfft, output=unit)
+                                get_evalresp_response_subset(
+                                    channel.response, t_samp, nfft,
+                                    output=unit, n_bins=n_bins)
                     except ValueError as e:
                         xml_resp_error = e
 
@@ -302,7 +320,7 @@ for _i in xrange(len(station_files)):
 
             # Parse the stderr to figure out if evalresp raised a unit not
             # known error.
-            if out and out.stderr and "are not supported" in out.stderr:
+            if evalresp_stderr and "are not supported" in evalresp_stderr:
                 unit_known_to_evalresp = False
 
             # Various unit errors.
@@ -334,15 +352,6 @@ for _i in xrange(len(station_files)):
                 counter["no_response_calculated_from_obspy"] += 1
                 continue
 
-            # Choose the first 1000 samples. Oftentimes numerically unstable
-            # FIR filters which manifests most strongly in high frequencies.
-            # And StationXML and RESP store numbers in a slightly different way
-            # and thus rounding errors occur.
-            seed_freq = seed_freq[:1000]
-            xml_freq = xml_freq[:1000]
-            seed_response = seed_response[:1000]
-            xml_response = xml_response[:1000]
-
             # If both managed to calculate somthing, compare them!
             np.testing.assert_allclose(seed_freq, xml_freq, rtol=1E-6)
             try:
@@ -365,6 +374,8 @@ for _i in xrange(len(station_files)):
             print_good("[OK]")
             counter["correct_responses"] += 1
 
+evalresp_worker.close()
+
 # Finally print some kind of report.
 print "\n\n"
 print 50 * "="
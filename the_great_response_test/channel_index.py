@@ -0,0 +1,69 @@
+"""
+Index over all channel epochs of an inventory.
+
+`Inventory.select()` walks and copies the whole inventory for every query
+which makes looking up every channel epoch of a large inventory quadratic.
+This index is built once per inventory and afterwards finds the channels
+active in a time window in logarithmic time. It returns the existing channel
+objects and not copies.
+"""
+import bisect
+import collections
+import itertools
+import math
+
+
+class ChannelEpochIndex:
+    """
+    Maps SEED ids to the epochs of their channels.
+
+    The epochs of each SEED id are sorted by their start times and stored
+    together with the running maximum of their end times. A binary search
+    finds the last epoch starting before the end of the requested window and
+    the running maximum tells when no earlier epoch can still overlap it.
+    """
+    def __init__(self, inventory):
+        epochs = collections.defaultdict(list)
+        for net in inventory:
+            for sta in net:
+                for cha in sta:
+                    seed_id = \
+                        f"{net.code}.{sta.code}.{cha.location_code}.{cha.code}"
+                    epochs[seed_id].append(
+                        (_to_timestamp(cha.start_date, -math.inf),
+                         _to_timestamp(cha.end_date, math.inf),
+                         cha))
+
+        self._index = {}
+        for seed_id, items in epochs.items():
+            items.sort(key=lambda x: x[0])
+            self._index[seed_id] = (
+                [_i[0] for _i in items],
+                list(itertools.accumulate([_i[1] for _i in items], max)),
+                items)
+
+    def select(self, seed_id, starttime, endtime):
+        """
+        Get all channels with the given SEED id that are active at any point
+        between `starttime` and `endtime` (both inclusive, just like
+        `Inventory.select()`), sorted by their start times.
+        """
+        if seed_id not in self._index:
+            return []
+        starts, max_ends, items = self._index[seed_id]
+        starttime = _to_timestamp(starttime, -math.inf)
+        endtime = _to_timestamp(endtime, math.inf)
+
+        channels = []
+        i = bisect.bisect_right(starts, endtime)
+        while i > 0 and max_ends[i - 1] >= starttime:
+            i -= 1
+            if items[i][1] >= starttime:
+                channels.append(items[i][2])
+        return channels[::-1]
+
+
+def _to_timestamp(time, default):
+    if time is None:
+        return default
+    return time.timestamp
@@ -0,0 +1,156 @@
+"""
+Adaptive frequency grids to compare responses at.
+
+A fixed logarithmic grid spends most of its frequencies on flat passbands and
+can step right over notches and the corners of steep filters. This grid
+starts with a few logarithmically spaced frequencies plus the frequencies of
+all analog poles and zeros and then bisects (in log frequency) every interval
+in which the response is not a straight line in log amplitude and phase
+until it is resolved to the requested accuracy.
+
+Building a grid evaluates the response a couple of times so grids are cached
+by a fingerprint of the response and the values of the response on the grid
+are returned as well so they do not have to be evaluated again.
+
+This module is also used by the scipy response test in
+`../the_great_response_test_scipy`.
+"""
+import numpy as np
+
+from lru_cache import LRUCache
+
+# Number of logarithmically spaced frequencies to start with.
+N_INITIAL_FREQUENCIES = 10
+
+# Intervals are bisected until the response at their center deviates by less
+# than this from the interpolation between their ends.
+RTOL = 5E-2
+
+# Never bisect intervals narrower than this factor between their ends.
+MIN_FREQUENCY_RATIO = 1.0 + 1E-4
+
+# Maximum number of refinement rounds. Every round is a call to evaluate the
+# response which costs about the same no matter how few frequencies are
+# refined, and the last rounds usually only refine a few narrow intervals
+# right at a notch.
+MAX_ROUNDS = 5
+
+
+def get_characteristic_frequencies(response):
+    """
+    Get the frequencies of all poles and zeros of all analog stages of a
+    response.
+    """
+    frequencies = []
+    for stage in response.response_stages:
+        transfer_function_type = getattr(stage, "pz_transfer_function_type",
+                                         None)
+        if transfer_function_type == "LAPLACE (RADIANS/SECOND)":
+            factor = 1.0 / (2.0 * np.pi)
+        elif transfer_function_type == "LAPLACE (HERTZ)":
+            factor = 1.0
+        else:
+            continue
+        frequencies.extend(abs(complex(_i)) * factor
+                           for _i in list(stage.poles) + list(stage.zeros))
+    return frequencies
+
+
+def _interpolation_error(left, right, center):
+    """
+    Relative deviation of the response at the centers of intervals from the
+    interpolation of log amplitude and phase between their ends.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        predicted = left * np.sqrt(right / left)
+        error = np.abs(center - predicted) / np.abs(center)
+    # Zeros (e.g. exact notches) and NaNs can't be refined any further.
+    error[~np.isfinite(error)] = 0.0
+    return error
+
+
+def get_adaptive_frequencies(evaluate, min_frequency, max_frequency,
+                             characteristic_frequencies=(), rtol=RTOL,
+                             max_frequencies=200, max_rounds=MAX_ROUNDS):
+    """
+    Build a frequency grid on which a response is well resolved.
+
+    :param evaluate: Callable taking an array of frequencies and returning
+        the complex response at them. It is called once per refinement round
+        with all new frequencies.
+    :param min_frequency: The lowest frequency of the grid.
+    :param max_frequency: The highest frequency of the grid.
+    :param characteristic_frequencies: Frequencies that are always part of
+        the grid if they are in range, e.g. from
+        `get_characteristic_frequencies()`.
+    :param rtol: Target accuracy of the interpolation between neighbouring
+        frequencies.
+    :param max_frequencies: Upper limit of the number of frequencies.
+    :param max_rounds: Upper limit of the number of refinement rounds.
+    :returns: The sorted frequencies and the response at them.
+    """
+    characteristic_frequencies = np.array(list(characteristic_frequencies))
+    frequencies = np.unique(np.concatenate([
+        np.logspace(np.log10(min_frequency), np.log10(max_frequency),
+                    N_INITIAL_FREQUENCIES),
+        characteristic_frequencies[
+            (characteristic_frequencies > min_frequency) &
+            (characteristic_frequencies < max_frequency)]]))
+    values = np.asarray(evaluate(frequencies), dtype=np.complex128)
+    # Intervals (by their left end) that still have to be checked.
+    unresolved = np.ones(len(frequencies) - 1, dtype=bool)
+
+    for _ in range(max_rounds):
+        if len(frequencies) >= max_frequencies:
+            break
+        indices = np.nonzero(
+            unresolved &
+            (frequencies[1:] / frequencies[:-1] > MIN_FREQUENCY_RATIO)
+        )[0][:max_frequencies - len(frequencies)]
+        if not len(indices):
+            break
+
+        centers = np.sqrt(frequencies[indices] * frequencies[indices + 1])
+        center_values = np.asarray(evaluate(centers), dtype=np.complex128)
+        bad = _interpolation_error(values[indices], values[indices + 1],
+                                   center_values) > rtol
+
+        # Both halves of every bad interval have to be checked again - the
+        # left half starts at the old left end, the right half at the center.
+        left_unresolved = np.zeros(len(frequencies), dtype=bool)
+        left_unresolved[indices] = bad
+        order = np.argsort(np.concatenate([frequencies, centers]),
+                           kind="stable")
+        frequencies = np.concatenate([frequencies, centers])[order]
+        values = np.concatenate([values, center_values])[order]
+        unresolved = np.concatenate([left_unresolved, bad])[order][:-1]
+
+    return frequencies, values
+
+
+class FrequencyGridCache(LRUCache):
+    """
+    Least recently used cache of the last `maxsize` frequency grids and the
+    values of the responses on them.
+
+    The keys have to identify the response and everything else the grid
+    depends on, e.g. a fingerprint of the response and the frequency range.
+    Failures to build a grid are cached as well and raised again.
+    """
+    def __init__(self, maxsize=10000):
+        super().__init__(maxsize)
+
+    def get(self, key, build):
+        """
+        Get the frequencies and values for `key`. `build` is called without
+        arguments to build them if they are not yet cached, e.g. a call to
+        `get_adaptive_frequencies()`.
+        """
+        def _build():
+            frequencies, values = build()
+            # Shared between all callers.
+            frequencies.flags.writeable = False
+            values.flags.writeable = False
+            return frequencies, values
+
+        return super().get(key, _build)
@@ -0,0 +1,118 @@
+"""
+Timing instrumentation for the response test.
+
+Every phase of testing a file (and the evaluation of every channel with
+every backend) is recorded as a named span. The spans of all files are
+written as JSON lines together with the size, the number of channels, and the
+number of response stages of each file, and summarized at the end of a run to
+find out which phases and which files scale badly.
+"""
+import collections
+import contextlib
+import json
+import time
+
+# A single timed phase. `attributes` is a dictionary with additional
+# information, e.g. the channel and backend of an evaluation. `depth` is the
+# number of spans it is nested in - 0 for the top-level phases of a file.
+Span = collections.namedtuple("Span",
+                              ["name", "duration", "attributes", "depth"])
+
+
+class SpanRecorder:
+    """
+    Records named spans. Spans can be nested.
+
+    >>> recorder = SpanRecorder()
+    >>> with recorder.span("compare"):
+    ...     with recorder.span("evaluate"):
+    ...         pass
+    >>> [(_i.name, _i.depth) for _i in recorder.spans]
+    [('evaluate', 1), ('compare', 0)]
+    """
+    def __init__(self):
+        self.spans = []
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        depth = self._depth
+        self._depth += 1
+        a = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth = depth
+            self.spans.append(
+                Span(name, time.perf_counter() - a, attributes, depth))
+
+
+def write_spans(fh, spans, **attributes):
+    """
+    Write spans as JSON lines to an open file. `attributes` (e.g. the
+    filename and file size) are added to every line.
+    """
+    for span in spans:
+        record = dict(attributes)
+        record.update(span.attributes)
+        record["name"] = span.name
+        record["duration"] = span.duration
+        record["depth"] = span.depth
+        fh.write(json.dumps(record) + "\n")
+
+
+class TimingSummary:
+    """
+    Aggregates the spans of many files to time per MB and time per channel
+    for every phase. Spans with a `backend` attribute are aggregated per
+    backend. The total time of a file only counts its top-level spans as the
+    nested ones are already part of them.
+    """
+    def __init__(self):
+        self._durations = collections.defaultdict(float)
+        self._megabytes = collections.defaultdict(float)
+        self._channels = collections.defaultdict(int)
+        self._files = {}
+
+    def add_file(self, filename, spans, file_size, n_channels):
+        durations = collections.defaultdict(float)
+        for span in spans:
+            name = span.name
+            if "backend" in span.attributes:
+                name += f" ({span.attributes['backend']})"
+            durations[name] += span.duration
+        for name, duration in durations.items():
+            self._durations[name] += duration
+            self._megabytes[name] += file_size / 1024 ** 2
+            self._channels[name] += n_channels
+        self._files[filename] = (
+            sum(_i.duration for _i in spans if _i.depth == 0), file_size,
+            n_channels)
+
+    def report(self, n_worst_files=10):
+        """
+        Return a human readable report as a string.
+        """
+        lines = [f"{'Phase':<24} {'Total [s]':>12} {'s/MB':>12} "
+                 f"{'s/channel':>12}"]
+        for name, duration in sorted(self._durations.items(),
+                                     key=lambda x: -x[1]):
+            per_mb = duration / self._megabytes[name] \
+                if self._megabytes[name] else float("nan")
+            per_channel = duration / self._channels[name] \
+                if self._channels[name] else float("nan")
+            lines.append(f"{name:<24} {duration:12.3f} {per_mb:12.4f} "
+                         f"{per_channel:12.4f}")
+
+        worst = sorted(
+            ((duration / (size / 1024 ** 2), filename, n_channels)
+             for filename, (duration, size, n_channels) in self._files.items()
+             if size),
+            reverse=True)[:n_worst_files]
+        if worst:
+            lines.append("")
+            lines.append("Slowest files per MB:")
+            for per_mb, filename, n_channels in worst:
+                lines.append(f"  {per_mb:10.3f} s/MB ({n_channels} channels): "
+                             f"{filename}")
+        return "\n".join(lines)
@@ -0,0 +1,70 @@
+"""
+Process pool that survives crashing workers.
+
+evalresp is C code and can segfault on broken responses which takes down the
+worker process and with it the whole `ProcessPoolExecutor`. The pool here
+finds out which item crashed a worker, reports it, and carries on with the
+remaining items.
+"""
+import collections
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+CRASH_MESSAGE = ("The worker process crashed - most likely evalresp "
+                 "segfaulted.")
+
+
+def _run_isolated(function, item, on_error):
+    """
+    Run `function` for a single item in its own worker process.
+    """
+    with concurrent.futures.ProcessPoolExecutor(1) as executor:
+        try:
+            return executor.submit(function, item).result()
+        except BrokenProcessPool:
+            return on_error(item, CRASH_MESSAGE)
+        except Exception as e:
+            return on_error(item, f"{e.__class__.__name__}: {e}")
+
+
+def iter_results(function, items, n_processes, on_error):
+    """
+    Call `function` for all items with `n_processes` worker processes and
+    yield the results as they finish - not necessarily in order.
+
+    At most one item per worker is submitted at a time so it is known which
+    items might have crashed a worker. If the pool breaks, these are run
+    again one at a time in their own process and the remaining items are run
+    in a new pool. If an item fails or crashed its worker,
+    `on_error(item, message)` is yielded instead of its result.
+
+    `function` must be picklable, i.e. defined at the top level of a module.
+    """
+    if n_processes == 1:
+        yield from map(function, items)
+        return
+
+    pending = collections.deque(items)
+    while pending:
+        suspects = []
+        with concurrent.futures.ProcessPoolExecutor(n_processes) as executor:
+            running = {}
+            while (pending or running) and not suspects:
+                while pending and len(running) < n_processes:
+                    item = pending.popleft()
+                    running[executor.submit(function, item)] = item
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    item = running.pop(future)
+                    try:
+                        yield future.result()
+                    except BrokenProcessPool:
+                        suspects.append(item)
+                    except Exception as e:
+                        yield on_error(item, f"{e.__class__.__name__}: {e}")
+            # All other items of a broken pool are suspects as well.
+            if suspects:
+                suspects.extend(running.values())
+        for item in suspects:
+            yield _run_isolated(function, item, on_error)
@@ -0,0 +1,50 @@
+"""
+Least recently used cache shared by the response tests.
+
+Also used by the Python 2 tests in `../stationxml_test`, so it has to stay
+compatible with Python 2.
+"""
+import collections
+
+
+class LRUCache(object):
+    """
+    Least recently used cache of the last `maxsize` values.
+
+    Values are built on demand by `get()`. Exceptions raised while building
+    a value are cached as well and raised again for the same key.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key, build):
+        """
+        Get the value for `key`. `build` is called without arguments to
+        build it if it is not yet cached.
+        """
+        if key in self._cache:
+            self.hits += 1
+            value = self._cache.pop(key)
+        else:
+            self.misses += 1
+            try:
+                value = build()
+            except Exception as e:
+                value = e
+        self._cache[key] = value
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._cache)}
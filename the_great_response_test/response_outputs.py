@@ -0,0 +1,99 @@
+"""
+Evaluate a response for several output units at once.
+
+The displacement, velocity, and acceleration responses of a channel only
+differ by powers of i * omega so it is enough to evaluate all stages once in
+the input unit of the response and derive the other outputs from it.
+"""
+import numpy as np
+
+# All supported output units and the power of i * omega by which they are
+# related to displacement.
+OUTPUTS = {"DISP": 0, "VEL": 1, "ACC": 2}
+
+
+def get_output_for_units(units):
+    """
+    Get the output (DISP, VEL, or ACC) that corresponds to the given input
+    units of a response.
+
+    Returns None for anything that is not a motion unit, e.g. pressure or
+    temperature. evalresp does not convert these so the outputs cannot be
+    derived from each other.
+    """
+    if not units:
+        return None
+    units = units.upper().replace(" ", "")
+    length, _, time = units.partition("/")
+    if length not in ("M", "CM", "MM", "UM", "NM"):
+        return None
+    if not time:
+        return "DISP"
+    if time in ("S", "SEC"):
+        return "VEL"
+    if time in ("S**2", "S2", "S/S", "SEC**2", "SEC2", "SEC/SEC"):
+        return "ACC"
+    return None
+
+
+def get_input_units(response):
+    """
+    Get the input units of the first stage of a response, falling back to
+    the ones of the instrument sensitivity.
+    """
+    if response.response_stages and response.response_stages[0].input_units:
+        return response.response_stages[0].input_units
+    if response.instrument_sensitivity:
+        return response.instrument_sensitivity.input_units
+    return None
+
+
+def convert_output(values, frequencies, from_output, to_output):
+    """
+    Convert a complex response evaluated at the given frequencies from one
+    output to another one.
+    """
+    order = OUTPUTS[from_output] - OUTPUTS[to_output]
+    if not order:
+        return values.copy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return values * (2j * np.pi * frequencies) ** order
+
+
+def evaluate_outputs(evaluate, frequencies, input_units, outputs=OUTPUTS):
+    """
+    Evaluate a response for multiple outputs.
+
+    :param evaluate: Callable taking an output unit and returning the complex
+        response at `frequencies` for it.
+    :param frequencies: The frequencies the response is evaluated at.
+    :param input_units: The input units of the response.
+    :param outputs: The outputs to compute.
+    :returns: Dictionary mapping each output to its response.
+
+    `evaluate` is called once in the output corresponding to the input units
+    and all others are derived from it. If the input units are not a motion
+    unit it is called once per output.
+    """
+    native = get_output_for_units(input_units)
+    if native is None:
+        return {output: evaluate(output) for output in outputs}
+    values = evaluate(native)
+    return {output: convert_output(values, frequencies, native, output)
+            for output in outputs}
+
+
+def get_evalresp_responses_for_frequencies(response, frequencies,
+                                           outputs=OUTPUTS):
+    """
+    Multi-output version of
+    `Response.get_evalresp_response_for_frequencies()`.
+
+    Returns a dictionary mapping each of the requested outputs to its
+    response.
+    """
+    return evaluate_outputs(
+        lambda output: response.get_evalresp_response_for_frequencies(
+            frequencies=frequencies, output=output),
+        frequencies=frequencies, input_units=get_input_units(response),
+        outputs=outputs)
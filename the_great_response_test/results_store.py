@@ -0,0 +1,184 @@
+"""
+Result records of the response test and a persistent SQLite store for them.
+
+Results are keyed by the SHA256 hash of the SEED file, the channel, the
+epoch, the unit, and the version of the tested code. Each result also stores
+the hash of the channel's RESP file which captures everything that goes into
+the response of that channel. This allows skipping unchanged files as well as
+unchanged channels of modified files in later runs.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import sqlite3
+
+import obspy
+
+# Result of a single file. The `results` are a list of `ResponseResult`
+# objects, `spans` is a list of timing spans, `attributes` contains
+# information about the file like its size and number of channels, and
+# `resp_hashes` maps each channel to the hash of its RESP file.
+FileResult = collections.namedtuple(
+    "FileResult", ["filename", "file_hash", "message", "spans", "attributes",
+                   "results", "resp_hashes"])
+
+# Result of a single channel epoch and unit. `passed` is None if the response
+# has been skipped and `max_deviation` is the largest absolute deviation from
+# the evalresp response relative to its largest absolute value. All units of
+# an epoch are evaluated together so they share the same `timings`. `reused`
+# is True if the result has been taken from the results store of an earlier
+# run.
+ResponseResult = collections.namedtuple(
+    "ResponseResult", ["channel", "starttime", "endtime", "unit", "passed",
+                       "max_deviation", "message", "timings", "reused"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_hash TEXT NOT NULL,
+    code_version TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    message TEXT,
+    passed INTEGER NOT NULL,
+    tested_at TEXT NOT NULL,
+    PRIMARY KEY (file_hash, code_version)
+);
+CREATE TABLE IF NOT EXISTS results (
+    file_hash TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    starttime TEXT NOT NULL,
+    endtime TEXT,
+    unit TEXT NOT NULL,
+    code_version TEXT NOT NULL,
+    resp_hash TEXT NOT NULL,
+    passed INTEGER,
+    max_deviation REAL,
+    message TEXT,
+    timings TEXT NOT NULL,
+    PRIMARY KEY (file_hash, channel, starttime, unit, code_version)
+);
+CREATE INDEX IF NOT EXISTS results_by_resp_hash
+    ON results (channel, resp_hash, code_version);
+"""
+
+_RESULT_COLUMNS = ("channel, starttime, endtime, unit, passed, max_deviation, "
+                   "message, timings")
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(filename):
+    with open(filename, "rb") as fh:
+        return hash_bytes(fh.read())
+
+
+def hash_files(filenames):
+    """
+    Combined hash of the content of multiple files.
+    """
+    return hash_bytes("".join(hash_file(_i) for _i in filenames).encode())
+
+
+class ResultsStore:
+    """
+    SQLite database with the results of all runs.
+
+    Only a single process should write to it but any number of processes can
+    read from it at the same time when opened with `read_only=True`.
+    """
+    def __init__(self, filename, read_only=False):
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{filename}?mode=ro",
+                                         uri=True, timeout=60)
+        else:
+            self._conn = sqlite3.connect(str(filename), timeout=60)
+            # Allows readers to run concurrently with the writer.
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_passed_file_results(self, file_hash, code_version):
+        """
+        Get all results of a file if it already passed all tests with the
+        given code version, otherwise None.
+
+        Returns a tuple of the list of results and a dictionary mapping each
+        channel to the hash of its RESP file.
+        """
+        row = self._conn.execute(
+            "SELECT passed FROM files WHERE file_hash = ? AND "
+            "code_version = ?", (file_hash, code_version)).fetchone()
+        if not row or not row[0]:
+            return None
+        resp_hashes = dict(self._conn.execute(
+            "SELECT DISTINCT channel, resp_hash FROM results WHERE "
+            "file_hash = ? AND code_version = ?", (file_hash, code_version)))
+        results = self._to_results(self._conn.execute(
+            f"SELECT {_RESULT_COLUMNS} FROM results WHERE file_hash = ? AND "
+            f"code_version = ?", (file_hash, code_version)))
+        return results, resp_hashes
+
+    def get_passed_channel_results(self, channel, resp_hash, code_version):
+        """
+        Get the results of a channel with the given RESP file hash if it has
+        been tested before with the given code version and nothing failed.
+        Returns an empty list otherwise.
+        """
+        results = {}
+        for result in self._to_results(self._conn.execute(
+                f"SELECT {_RESULT_COLUMNS} FROM results WHERE channel = ? "
+                f"AND resp_hash = ? AND code_version = ?",
+                (channel, resp_hash, code_version))):
+            if result.passed is False:
+                return []
+            # The same channel might have been tested as part of different
+            # files.
+            results[(str(result.starttime), result.unit)] = result
+        return list(results.values())
+
+    def add_file_result(self, file_result, code_version):
+        """
+        Store a `FileResult` and all its response results.
+        """
+        passed = not file_result.message and all(
+            _i.passed is not False for _i in file_result.results)
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (file_result.file_hash, code_version,
+                 str(file_result.filename), file_result.message, passed,
+                 datetime.datetime.now(datetime.timezone.utc).isoformat()))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(file_result.file_hash, _i.channel, str(_i.starttime),
+                  str(_i.endtime) if _i.endtime else None,
+                  # Skipped epochs might not have a unit.
+                  _i.unit or "",
+                  code_version, file_result.resp_hashes[_i.channel],
+                  _i.passed, _i.max_deviation, _i.message,
+                  json.dumps(_i.timings))
+                 for _i in file_result.results])
+
+    @staticmethod
+    def _to_results(rows):
+        return [ResponseResult(
+            channel=channel, starttime=obspy.UTCDateTime(starttime),
+            endtime=obspy.UTCDateTime(endtime) if endtime else None,
+            unit=unit or None,
+            passed=None if passed is None else bool(passed),
+            max_deviation=max_deviation, message=message,
+            timings=json.loads(timings), reused=True)
+            for channel, starttime, endtime, unit, passed, max_deviation,
+            message, timings in rows]
@@ -1,8 +1,9 @@
 import collections
+import io
+import json
 import os
 import pathlib
-import time
-import shutil
+import pickle
 import warnings
 
 import numpy as np
@@ -11,55 +12,128 @@ import tqdm
 import obspy
 from obspy.io.xseed import Parser
 from obspy.io.xseed.utils import SEEDParserException
-from obspy.core.util.testing import NamedTemporaryFile
 from obspy.signal.invsim import evalresp_for_frequencies
 
+from channel_index import ChannelEpochIndex
+from frequency_grid import (FrequencyGridCache, get_adaptive_frequencies,
+                            get_characteristic_frequencies)
+from instrumentation import SpanRecorder, TimingSummary, write_spans
+from isolated_pool import iter_results
+from seed_resp import iter_resp
+from stationxml_buffer import write_stationxml_to_buffer
+from response_outputs import (evaluate_outputs, get_input_units,
+                              get_output_for_units)
+from results_store import (FileResult, ResponseResult, ResultsStore,
+                           hash_bytes, hash_file, hash_files)
+
 # Directory with SEED files.
 data_dir = pathlib.Path(__file__).parent / "seed_files"
 
-# Directory where SEED files will be copied if all tests pass for it.
-success_dir = data_dir / "success"
-if not success_dir.exists():
-    os.makedirs(success_dir)
+# Directory where the results of each run are stored.
+work_dir = pathlib.Path(__file__).parent / "work_dir"
 
-# Sort the SEED files by size to first test a larger variety of files.
-files = sorted(list(data_dir.glob("*dataless")),
-               key=lambda x: x.stat().st_size)
+# All result records of a run are written to this file as JSON lines.
+results_file = work_dir / "results.jsonl"
 
-# Directory where temporary files live.
-work_dir = pathlib.Path(__file__).parent / "work_dir"
-if not work_dir.exists():
-    os.makedirs(work_dir)
+# The timings of all phases of a run are written to this file as JSON lines.
+timings_file = work_dir / "timings.jsonl"
+
+# SQLite database with the results of all runs.
+results_db = work_dir / "results.sqlite"
+
+# Only test files and channels that changed or have not yet passed with the
+# current code version. Otherwise everything is tested again.
+INCREMENTAL = True
+
+# Version of the tested code and of this test including all its settings
+# (units, frequencies, tolerances, ...). Results from other versions are not
+# reused.
+_HARNESS_HASH = hash_files(sorted(pathlib.Path(__file__).parent.glob("*.py")))
+CODE_VERSION = f"{obspy.__version__}-{_HARNESS_HASH[:16]}"
 
 # Invalid responses are automatically skipped.
 SKIP_INVALID_RESPONSES = True
 
-counter = 0
+# Number of worker processes - each one tests a single SEED file at a time.
+# If a worker dies (e.g. evalresp segfaults) the files it might have been
+# testing are tested again one at a time, each in its own process, so only
+# the file that crashes it is recorded as failed. Set to 1 to run everything
+# in the current process which is useful for debugging.
+N_PROCESSES = os.cpu_count()
 
-for filename in files:
-    print("=================================")
-    print(f"FILENAME: {filename}")
-    print("=================================")
+# Units to compare the responses in.
+UNITS = ("DISP", "VEL", "ACC")
 
-    # Parse it with the existing ObsPy Parser object.
-    a = time.time()
+# Number of logarithmically spaced frequencies to compare at.
+N_FREQUENCIES = 100
+
+# Compare on an adaptive grid of at most `N_FREQUENCIES` frequencies that is
+# dense around corners and notches and sparse in flat passbands instead. It
+# is built from the response read from the SEED file, falling back to the
+# fixed grid if that cannot be evaluated. Grids are only built once per
+# identical response and the values of the response computed while building
+# them are used for the comparison.
+ADAPTIVE_FREQUENCIES = True
+
+# Frequency grids of all responses tested by this process.
+GRID_CACHE = FrequencyGridCache()
+
+
+def test_single_seed_file(filename):
+    """
+    Test all responses in a single SEED file and return a `FileResult`.
+
+    Mismatches and failing response calculations are recorded in the
+    returned result instead of stopping so this can run unattended in worker
+    processes.
+    """
+    store = ResultsStore(results_db, read_only=True) if INCREMENTAL else None
     try:
-        parser = Parser(str(filename))
-    except SEEDParserException:
-        print("Could not parse the SEED file. Is it invalid?")
-        continue
-    b = time.time()
-    print(f"Time for parsing SEED file with obspy.io.xseed: {b -a}")
-
-    # Create RESP files.
-    a = time.time()
-    resp_files = {_i[0]: _i[1] for _i in parser.get_resp()}
-    b = time.time()
-    print(f"Time for writing RESP files: {b - a}")
+        return _test_single_seed_file(filename, store)
+    finally:
+        if store:
+            store.close()
+
+
+def _test_single_seed_file(filename, store):
+    recorder = SpanRecorder()
+    attributes = {"file_size": filename.stat().st_size}
+    results = []
+    resp_hashes = {}
+
+    def _file_result(message=None):
+        return FileResult(filename=filename, file_hash=file_hash,
+                          message=message, spans=recorder.spans,
+                          attributes=attributes, results=results,
+                          resp_hashes=resp_hashes)
+
+    def _skip(channel, start, end, msg, unit=None):
+        results.append(ResponseResult(
+            channel=channel, starttime=start, endtime=end, unit=unit,
+            passed=None, max_deviation=None, message=msg, timings={},
+            reused=False))
+
+    # Nothing to do if the very same file already passed before.
+    with recorder.span("hash_file"):
+        file_hash = hash_file(filename)
+    if store:
+        previous = store.get_passed_file_results(file_hash, CODE_VERSION)
+        if previous is not None:
+            results.extend(previous[0])
+            resp_hashes.update(previous[1])
+            return _file_result()
+
+    # Parse it with the existing ObsPy Parser object.
+    with recorder.span("parse_seed"):
+        try:
+            parser = Parser(str(filename))
+        except SEEDParserException:
+            return _file_result(
+                "Could not parse the SEED file. Is it invalid?")
 
     # Parse it with the read_inventory() function.
-    a = time.time()
-    with warnings.catch_warnings(record=True) as w:
+    with recorder.span("read_seed"), \
+            warnings.catch_warnings(record=True) as w:
         warnings.simplefilter("always")
         inv_from_seed = obspy.read_inventory(
             str(filename),
@@ -90,22 +164,22 @@ for filename in files:
     if 62 in parser.blockettes and parser.blockettes[62]:
         validate = False
 
-    print(f"Validate StationXML: {validate}")
-    b = time.time()
-    print(f"Time for parsing SEED File to inventory object: {b - a}")
-
-    # Write it out as StationXML and validate it (if possible)...
-    a = time.time()
-    inv_from_seed.write(str(work_dir / "tmp.xml"), format="stationxml",
-                        validate=validate)
-    b = time.time()
-    print(f"Time to write and validate StationXML: {b - a}")
+    # Write it out as StationXML to memory and validate it (if possible)...
+    with recorder.span("write_stationxml", validate=validate):
+        try:
+            xml_buffer = write_stationxml_to_buffer(inv_from_seed,
+                                                    validate=validate)
+        except Exception as e:
+            return _file_result(
+                f"Failed to write or validate StationXML: {e}")
 
     # Read again.
-    a = time.time()
-    inv_from_xml = obspy.read_inventory(str(work_dir / "tmp.xml"))
-    b = time.time()
-    print(f"Time to read StationXML: {b - a}")
+    with recorder.span("read_stationxml"):
+        inv_from_xml = obspy.read_inventory(xml_buffer, format="STATIONXML")
+
+    # Index all channel epochs once so they can be looked up quickly.
+    seed_index = ChannelEpochIndex(inv_from_seed)
+    xml_index = ChannelEpochIndex(inv_from_xml)
 
     # Get all the channels and epochs - get it from the SEED files as it is
     # likely the most complete.
@@ -114,13 +188,44 @@ for filename in files:
         channels[c["channel_id"]].append(
             (c["start_date"], c["end_date"]))
 
+    attributes["n_channels"] = len(channels)
+    attributes["n_stages"] = sum(
+        len(cha.response.response_stages)
+        for net in inv_from_seed for sta in net for cha in sta
+        if cha.response)
+
     # Loop over each channel.
-    for channel, epochs in tqdm.tqdm(channels.items()):
-        with NamedTemporaryFile() as tf:
-            # Write the corresponding RESP file.
-            r = resp_files["RESP.%s" % channel]
+    with recorder.span("compare"):
+        # The RESP files are only created when they are needed.
+        for resp_name, r in iter_resp(parser):
+            channel = resp_name[len("RESP."):]
+            epochs = channels.pop(channel, None)
+            if not epochs:
+                continue
+
+            # Get the content of the corresponding RESP file.
             r.seek(0, 0)
-            tf.write(r.read())
+            resp_data = r.read()
+
+            # Reuse the results if the channel did not change and passed
+            # before.
+            resp_hashes[channel] = hash_bytes(resp_data)
+            if store:
+                previous = store.get_passed_channel_results(
+                    channel, resp_hashes[channel], CODE_VERSION)
+                if previous:
+                    results.extend(previous)
+                    continue
+
+            # Read the RESP file with obspy.core - only once per channel and
+            # directly from memory. It is reused for all epochs and units.
+            try:
+                resp_index = ChannelEpochIndex(obspy.read_inventory(
+                    io.BytesIO(resp_data), format="RESP"))
+                resp_error = None
+            except Exception as e:
+                resp_index = None
+                resp_error = str(e)
 
             # Now loop over the epochs.
             for start, end in epochs:
@@ -130,43 +235,37 @@ for filename in files:
                 else:
                     t = start + 10
 
-                net, sta, loc, cha = channel.split(".")
+                cha = channel.split(".")[-1]
 
                 # Find the response in the inventory read from the SEED file.
-                _inv_t = inv_from_seed.select(network=net, station=sta,
-                                              location=loc, channel=cha,
-                                              starttime=t - 1, endtime=t + 1)
+                _cha_t = seed_index.select(channel, t - 1, t + 1)
                 # Should now only be a single channel.
-                try:
-                    assert _inv_t.get_contents()["channels"] == [channel]
-                except AssertionError:
-                    msg = ("`inv.select()` did not work as expected. This is "
+                if len(_cha_t) != 1:
+                    msg = ("Did not find exactly one channel epoch. This is "
                            "likely because the start-and end dates in one of "
                            "the files is wrong. Please fix it and run again. "
                            "This channel will be skipped.")
-                    print(msg)
+                    _skip(channel, start, end, msg)
                     continue
-                response_from_seed = _inv_t[0][0][0].response
+                response_from_seed = _cha_t[0].response
                 # Log channels don't really have a response - skip them.
                 if response_from_seed is None and cha == "LOG":
                     continue
-                _inv_xml_t = inv_from_xml.select(network=net, station=sta,
-                                                 location=loc, channel=cha,
-                                                 starttime=t - 1, endtime=t + 1)
-                assert _inv_xml_t.get_contents()["channels"] == [channel]
-                response_from_stationxml = _inv_xml_t[0][0][0].response
-
-                # Get the Nyquist frequency of the channel.
-                if hasattr(_inv_xml_t[0][0][0], "sample_rate"):
-                    nyquist = _inv_xml_t[0][0][0].sample_rate / 2.0
-                else:
-                    nyquist = 1000.0
+                _cha_xml_t = xml_index.select(channel, t - 1, t + 1)
+                if len(_cha_xml_t) != 1:
+                    _skip(channel, start, end,
+                          "Channel not found in the StationXML file.")
+                    continue
+                response_from_stationxml = _cha_xml_t[0].response
 
-                # Only compare up to Nyquist as algorithms can get pretty
-                # unstable afterwards and they are sensitive to very small
-                # changes in later decimal digits which are unavoidable when
-                # converting between formats.
-                frequencies = np.logspace(-3, np.log10(nyquist), 100)
+                # And the response read from the RESP file with ObsPy.
+                response_from_resp = None
+                if resp_index is not None:
+                    _cha_resp_t = resp_index.select(channel, t - 1, t + 1)
+                    if _cha_resp_t:
+                        response_from_resp = _cha_resp_t[0].response
+                    else:
+                        resp_error = "Channel not found in the RESP file."
 
                 # Don't compare the response list stages as we handle them a
                 # bit differently from evalresp - but this is tested elsewhere
@@ -181,118 +280,271 @@ for filename in files:
                 # should just be flat and real after all.
                 if response_from_seed and \
                         not response_from_seed.response_stages:
-                    print("No response stages - just stage 0 - "
-                          "will be skipped.")
+                    _skip(channel, start, end,
+                          "No response stages - just stage 0.")
                     continue
 
                 # Also skip responses that only have a couple of gain stages.
                 if response_from_seed and set([_i.__class__.__name__
                         for _i in response_from_seed.response_stages]) == \
                         {'ResponseStage'}:
-                    print("Only a couple of gain stages - will be skipped.")
+                    _skip(channel, start, end, "Only a couple of gain stages.")
                     continue
 
-                # Loop over all units.
-                for unit in ("DISP", "VEL", "ACC"):
-                    # First try evalresp - if it does not work just go to the
-                    # next epoch. The reasoning is that we want to make sure
-                    # that our responses (calculated no matter which way) are
-                    # equal to evalresp.
-                    try:
-                        r_evalresp = evalresp_for_frequencies(
-                            t_samp=None, frequencies=frequencies,
-                            filename=tf.name, date=t, units=unit)
-                    except:
-                        continue
-
-                    # Get response from SEED file.
-                    try:
-                        r_seed = response_from_seed\
-                            .get_evalresp_response_for_frequencies(
-                                frequencies=frequencies, output=unit)
-                    except Exception as e:
-                        print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                        print(e)
-                        print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                        import pdb; pdb.set_trace()
-                        print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-
-                    # Get response from the StationXML file.
-                    try:
-                        r_stationxml = response_from_stationxml\
-                            .get_evalresp_response_for_frequencies(
-                                frequencies=frequencies, output=unit)
-                    except Exception as e:
-                        print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                        print(e)
-                        print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                        import pdb; pdb.set_trace()
-                        print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-
-                    # Last but not least, also read the RESP file with
-                    # obspy.core
-                    try:
-                        r_resp_obspy = obspy.read_inventory(tf.name).select(
-                            starttime=t - 1,
-                            endtime=t + 1)[0][0][0].response\
-                            .get_evalresp_response_for_frequencies(
-                            frequencies=frequencies, output=unit)
-                    except Exception as e:
-                        print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                        print(e)
-                        print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                        import pdb; pdb.set_trace()
-
-
-                    # Convert NaNs and infs to actual numbers both on the real
-                    # as well as the complex part. We again want to assert that
-                    # all responses are equal to what evalresp would do so
-                    # this should be safe enought.
-                    r_evalresp.real = np.nan_to_num(r_evalresp.real)
-                    r_evalresp.imag = np.nan_to_num(r_evalresp.imag)
-                    r_seed.real = np.nan_to_num(r_seed.real)
-                    r_seed.imag = np.nan_to_num(r_seed.imag)
-                    r_stationxml.real = np.nan_to_num(r_stationxml.real)
-                    r_stationxml.imag = np.nan_to_num(r_stationxml.imag)
-                    r_resp_obspy.real = np.nan_to_num(r_resp_obspy.real)
-                    r_resp_obspy.imag = np.nan_to_num(r_resp_obspy.imag)
-
-
-                    # Adaptive absolute tolerance to deal with very
-                    # small values.
-                    atol = 1E-5 * max(np.abs(r_evalresp.real).max(),
-                                      np.abs(r_evalresp.imag).max())
-
-                    cases = [(r_seed, "SEED file"),
-                             (r_stationxml, "StationXML file"),
-                             (r_resp_obspy, "RESP file with ObsPy")]
-
-                    for c, msg in cases:
-                        try:
-                            np.testing.assert_allclose(
-                                r_evalresp.real,
-                                c.real,
-                                rtol=1E-6, atol=atol)
-                        except Exception as e:
-                            print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                            print(f"{msg}, real")
-                            print(e)
-                            print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                            import pdb; pdb.set_trace()
-                        try:
-                            np.testing.assert_allclose(
-                                r_evalresp.imag,
-                                c.imag,
-                                rtol=1E-6, atol=atol)
-                        except Exception as e:
-                            print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                            print(f"{msg}, imag")
-                            print(e)
-                            print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                            import pdb; pdb.set_trace()
-
-                    counter += 1
-
-    print(f"Successfully tested {counter} responses for equality!!")
-    # Move to success folder.
-    shutil.move(filename, success_dir / filename.name)
+                # Get the Nyquist frequency of the channel.
+                if hasattr(_cha_xml_t[0], "sample_rate"):
+                    nyquist = _cha_xml_t[0].sample_rate / 2.0
+                else:
+                    nyquist = 1000.0
+
+                # Only compare up to Nyquist as algorithms can get pretty
+                # unstable afterwards and they are sensitive to very small
+                # changes in later decimal digits which are unavoidable when
+                # converting between formats.
+                with recorder.span("frequency_grid", channel=channel):
+                    frequencies, seed_values = _get_frequencies(
+                        response_from_seed, nyquist)
+
+                results.extend(_compare_epoch(
+                    channel=channel, start=start, end=end, t=t,
+                    frequencies=frequencies, resp_data=resp_data,
+                    response_from_seed=response_from_seed,
+                    seed_values=seed_values,
+                    response_from_stationxml=response_from_stationxml,
+                    response_from_resp=response_from_resp,
+                    resp_error=resp_error, recorder=recorder))
+
+    return _file_result()
+
+
+def _get_response_key(response):
+    """
+    Hash identifying identical responses. These have the same stages and
+    sensitivity and thus pickle to the same bytes.
+    """
+    return hash_bytes(pickle.dumps((response.response_stages,
+                                    response.instrument_sensitivity,
+                                    response.instrument_polynomial)))
+
+
+def _get_frequencies(response, nyquist):
+    """
+    Get the frequencies to compare a response at.
+
+    Returns the frequencies and the response at them in the output that
+    corresponds to its input units. The latter is None if it is not known.
+    """
+    if ADAPTIVE_FREQUENCIES and response is not None:
+        output = get_output_for_units(get_input_units(response))
+        try:
+            frequencies, values = GRID_CACHE.get(
+                (_get_response_key(response), nyquist, output),
+                lambda: get_adaptive_frequencies(
+                    lambda f: response.get_evalresp_response_for_frequencies(
+                        frequencies=f, output=output or "DEF"),
+                    1E-3, nyquist, get_characteristic_frequencies(response),
+                    max_frequencies=N_FREQUENCIES))
+        except Exception:
+            pass
+        else:
+            return frequencies, values if output else None
+    return np.logspace(-3, np.log10(nyquist), N_FREQUENCIES), None
+
+
+def _compare_epoch(channel, start, end, t, frequencies, resp_data,
+                   response_from_seed, seed_values, response_from_stationxml,
+                   response_from_resp, resp_error, recorder):
+    """
+    Compare the responses from all sources for all units and return a list
+    of `ResponseResult` objects, one per unit.
+
+    `resp_data` is the content of the RESP file of the channel and
+    `response_from_resp` is the response read from it with ObsPy.
+    It is None if that failed in which case `resp_error` holds the reason.
+    `seed_values` is the response from the SEED file in the output of its
+    input units if it is already known, otherwise None.
+    The evaluation with every backend is recorded as an `evaluate` span.
+    """
+    timings = {}
+    n_stages = len(response_from_seed.response_stages) \
+        if response_from_seed else 0
+
+    def _span(backend):
+        return recorder.span("evaluate", channel=channel, backend=backend,
+                             n_stages=n_stages)
+
+    def _results(passed, message):
+        return [ResponseResult(
+            channel=channel, starttime=start, endtime=end, unit=unit,
+            passed=passed, max_deviation=None, message=message,
+            timings=timings, reused=False) for unit in UNITS]
+
+    # Every source is only evaluated once in the input unit of the response
+    # and the other units are derived from that.
+    input_units = get_input_units(response_from_seed) \
+        if response_from_seed else None
+
+    # First try evalresp - if it does not work just go to the next epoch. The
+    # reasoning is that we want to make sure that our responses (calculated no
+    # matter which way) are equal to evalresp. ObsPy reads the RESP data
+    # without rewinding so every call gets its own in-memory file.
+    try:
+        with _span("evalresp"):
+            r_evalresp = evaluate_outputs(
+                lambda unit: evalresp_for_frequencies(
+                    t_samp=None, frequencies=frequencies,
+                    filename=io.BytesIO(resp_data), date=t, units=unit),
+                frequencies=frequencies, input_units=input_units,
+                outputs=UNITS)
+    except Exception as e:
+        return _results(None, f"evalresp failed: {e}")
+    timings["evalresp"] = recorder.spans[-1].duration
+
+    cases = []
+    for response, values, msg, name in (
+            (response_from_seed, seed_values, "SEED file", "seed"),
+            (response_from_stationxml, None, "StationXML file", "stationxml"),
+            (response_from_resp, None, "RESP file with ObsPy", "resp")):
+        try:
+            if response is None and name == "resp":
+                raise ValueError(resp_error)
+            with _span(name):
+                cases.append((evaluate_outputs(
+                    lambda unit: response
+                    .get_evalresp_response_for_frequencies(
+                        frequencies=frequencies, output=unit)
+                    if values is None else values,
+                    frequencies=frequencies, input_units=input_units,
+                    outputs=UNITS), msg))
+        except Exception as e:
+            return _results(False, f"{msg}: {e}")
+        timings[name] = recorder.spans[-1].duration
+
+    results = []
+    for unit in UNITS:
+        max_deviation, failures = _compare_unit(
+            r_evalresp[unit], [(c[unit], msg) for c, msg in cases])
+        results.append(ResponseResult(
+            channel=channel, starttime=start, endtime=end, unit=unit,
+            passed=not failures, max_deviation=max_deviation,
+            message="\n".join(failures) or None, timings=timings,
+            reused=False))
+    return results
+
+
+def _compare_unit(r_evalresp, cases):
+    """
+    Compare the responses of all `(response, name)` cases to the evalresp
+    response of a single unit.
+
+    Returns the maximum relative deviation and a list of failure messages.
+    """
+    # Convert NaNs and infs to actual numbers both on the real as well as the
+    # complex part. We again want to assert that all responses are equal to
+    # what evalresp would do so this should be safe enought.
+    for r in [r_evalresp] + [c for c, _ in cases]:
+        r.real = np.nan_to_num(r.real)
+        r.imag = np.nan_to_num(r.imag)
+
+    # Adaptive absolute tolerance to deal with very small values.
+    scale = max(np.abs(r_evalresp.real).max(),
+                np.abs(r_evalresp.imag).max())
+    atol = 1E-5 * scale
+
+    max_deviation = 0.0
+    failures = []
+    for c, msg in cases:
+        deviation = max(np.abs(r_evalresp.real - c.real).max(),
+                        np.abs(r_evalresp.imag - c.imag).max())
+        if scale:
+            deviation /= scale
+        max_deviation = max(max_deviation, float(deviation))
+
+        for part, expected, actual in (("real", r_evalresp.real, c.real),
+                                       ("imag", r_evalresp.imag, c.imag)):
+            try:
+                np.testing.assert_allclose(expected, actual, rtol=1E-6,
+                                           atol=atol)
+            except AssertionError as e:
+                failures.append(f"{msg}, {part}: {e}")
+
+    return max_deviation, failures
+
+
+def _result_to_json(filename, result):
+    record = result._asdict()
+    record["filename"] = str(filename)
+    for key in ("starttime", "endtime"):
+        if record[key] is not None:
+            record[key] = str(record[key])
+    return json.dumps(record)
+
+
+def _crashed_file_result(filename, message):
+    return FileResult(filename=filename, file_hash=hash_file(filename),
+                      message=message, spans=[],
+                      attributes={"file_size": filename.stat().st_size},
+                      results=[], resp_hashes={})
+
+
+def main():
+    if not work_dir.exists():
+        os.makedirs(work_dir)
+    # Also creates the database so the workers can open it read-only.
+    store = ResultsStore(results_db)
+
+    # Sort the SEED files by size to first test a larger variety of files.
+    files = sorted(list(data_dir.glob("*dataless")),
+                   key=lambda x: x.stat().st_size)
+
+    counter = collections.Counter()
+    timing_summary = TimingSummary()
+
+    with open(results_file, "w") as fh, open(timings_file, "w") as fh_t:
+        file_results = iter_results(test_single_seed_file, files,
+                                    N_PROCESSES, _crashed_file_result)
+        for file_result in tqdm.tqdm(file_results, total=len(files)):
+            store.add_file_result(file_result, CODE_VERSION)
+            write_spans(fh_t, file_result.spans,
+                        filename=str(file_result.filename),
+                        **file_result.attributes)
+            timing_summary.add_file(
+                filename=str(file_result.filename), spans=file_result.spans,
+                file_size=file_result.attributes["file_size"],
+                n_channels=file_result.attributes.get("n_channels", 0))
+
+            if file_result.message:
+                tqdm.tqdm.write(
+                    f"{file_result.filename}: {file_result.message}")
+                counter["file_errors"] += 1
+                continue
+
+            passed = [_i.passed for _i in file_result.results]
+            counter["passed"] += passed.count(True)
+            counter["failed"] += passed.count(False)
+            counter["skipped"] += passed.count(None)
+            counter["reused"] += sum(_i.reused for _i in file_result.results)
+
+            for result in file_result.results:
+                fh.write(_result_to_json(file_result.filename, result) + "\n")
+                if result.passed is False:
+                    tqdm.tqdm.write(
+                        f"FAILED: {file_result.filename.name} "
+                        f"{result.channel} {result.starttime} {result.unit}: "
+                        f"{result.message}")
+
+    store.close()
+
+    print(timing_summary.report())
+    print()
+    print(f"Successfully tested {counter['passed']} responses for equality!!")
+    print(f"Failed responses: {counter['failed']}")
+    print(f"Skipped responses: {counter['skipped']}")
+    print(f"Results reused from earlier runs: {counter['reused']}")
+    print(f"Files that could not be tested: {counter['file_errors']}")
+    print(f"All results have been written to '{results_file}' and "
+          f"'{results_db}', all timings to '{timings_file}'.")
+
+
+if __name__ == "__main__":
+    main()
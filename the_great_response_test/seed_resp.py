@@ -0,0 +1,31 @@
+"""
+Lazily create the RESP files of a SEED volume.
+
+`Parser.get_resp()` creates the RESP files of all channels of a SEED volume
+at once which for large network dataless files requires several GB of memory.
+"""
+import collections
+import copy
+
+
+def iter_resp(parser):
+    """
+    Yield the `(name, BytesIO)` tuples of `Parser.get_resp()` lazily.
+
+    The RESP files are created one station at a time so at most the RESP
+    files of a single station are in memory. All epochs of a station are
+    passed together as `Parser.get_resp()` merges the RESP files of channels
+    appearing in multiple station epochs.
+    """
+    stations = collections.OrderedDict()
+    for station in parser.stations:
+        key = (station[0].network_code.strip(),
+               station[0].station_call_letters.strip())
+        stations.setdefault(key, []).append(station)
+
+    for station_epochs in stations.values():
+        # Shallow copy sharing everything but the list of stations.
+        station_parser = copy.copy(parser)
+        station_parser.stations = station_epochs
+        for name, resp in station_parser.get_resp():
+            yield name, resp
@@ -0,0 +1,58 @@
+"""
+Write StationXML files to memory and validate them with a cached schema.
+
+`Inventory.write(..., format="stationxml", validate=True)` loads and compiles
+the StationXML schema for every single file. Here the compiled schema is
+cached for the lifetime of the process.
+"""
+import functools
+import io
+import pathlib
+
+from lxml import etree
+
+import obspy.io.stationxml
+
+XSD_DIRECTORY = pathlib.Path(obspy.io.stationxml.__file__).parent / "data"
+
+
+@functools.lru_cache()
+def get_stationxml_schema(schema_version=None):
+    """
+    Get the compiled StationXML schema for the given schema version. Falls
+    back to the most recent schema shipped with ObsPy if that version is not
+    available.
+    """
+    xsd_files = sorted(XSD_DIRECTORY.glob("fdsn-station*.xsd"))
+    xsd_file = XSD_DIRECTORY / f"fdsn-station-{schema_version}.xsd"
+    if xsd_file not in xsd_files:
+        xsd_file = xsd_files[-1]
+    return etree.XMLSchema(etree.parse(str(xsd_file)))
+
+
+def validate_stationxml(buf):
+    """
+    Validate the StationXML document in the file-like object `buf` and raise
+    an exception if it is not valid.
+    """
+    buf.seek(0, 0)
+    doc = etree.parse(buf)
+    schema = get_stationxml_schema(doc.getroot().get("schemaVersion"))
+    if not schema.validate(doc):
+        msg = "The created file fails to validate.\n"
+        for err in schema.error_log:
+            msg += f"\t{err}\n"
+        raise Exception(msg)
+
+
+def write_stationxml_to_buffer(inventory, validate=False):
+    """
+    Write the inventory as StationXML to an in-memory buffer, optionally
+    validate it, and return the buffer rewound to its start.
+    """
+    buf = io.BytesIO()
+    inventory.write(buf, format="stationxml", validate=False)
+    if validate:
+        validate_stationxml(buf)
+    buf.seek(0, 0)
+    return buf
@@ -1,8 +1,25 @@
-import obspy
+import collections
+import concurrent.futures
+import copy
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import typing
+
+import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from obspy.clients.fdsn import Client
+from obspy.clients.fdsn.client import build_url
 from obspy.clients.fdsn.header import URL_MAPPINGS
 
-import pathlib
+from compressed_files import compress, get_filename
 
 DATA_PATH = pathlib.Path("./data")
 PROVIDERS = sorted(URL_MAPPINGS.keys())
@@ -15,19 +32,261 @@ PROVIDERS = ["IRIS"]
 NETWORK = "IU"
 STATION = "A*"
 
+# Number of providers to download from at the same time.
+MAX_CONCURRENT_PROVIDERS = 8
+# Maximum number of concurrent requests to a single provider. Don't go too
+# high - the data centers are shared resources.
+MAX_CONCURRENT_REQUESTS_PER_PROVIDER = 4
+
+# Failed requests (connection errors and 429/5xx status codes) are retried
+# with an exponential backoff of BACKOFF_FACTOR * 2 ** (retry - 1) seconds.
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 2.0
+# Timeout for a single request in seconds.
+TIMEOUT = 300
+
+# Number of stations requested with a single bulk request.
+BULK_SIZE = 50
+
+# Size, checksum, and server timestamp of every downloaded file are recorded
+# here. Only files that are in the manifest and match it are considered to be
+# complete - all others are downloaded (again).
+MANIFEST_PATH = DATA_PATH / "manifest.jsonl"
+# Also compare the checksums of existing files and not just their sizes.
+VERIFY_CHECKSUMS = True
+
+# Compress the StationXML files on disk - either None, "gzip", or "zstd"
+# (requires the `zstandard` package). 01_run_test.py reads all of them.
+COMPRESSION = None
+
+
+class Manifest:
+    """
+    Thread-safe, append-only manifest of all downloaded files.
+
+    Every line is a JSON object describing a single file. Later lines
+    overwrite earlier ones for the same file and incomplete lines (e.g. from
+    a killed run) are ignored.
+
+    Different providers can return the same station. Every file is claimed
+    with `claim()` before it is downloaded so it is only downloaded once per
+    run.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._claimed = set()
+        if path.exists():
+            with open(path, "r") as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._entries[entry["filename"]] = entry
+
+    def is_complete(self, filename: pathlib.Path, verify_checksum: bool) -> bool:
+        """
+        Check if a file exists and matches its entry in the manifest.
+        """
+        entry = self._entries.get(filename.name)
+        if entry is None or not filename.exists():
+            return False
+        if filename.stat().st_size != entry["size"]:
+            return False
+        if verify_checksum:
+            return hashlib.sha256(filename.read_bytes()).hexdigest() == entry["sha256"]
+        return True
+
+    def claim(self, filename: pathlib.Path) -> bool:
+        """
+        Claim a file for downloading it. Returns False if it has already been
+        claimed in this run.
+        """
+        with self._lock:
+            if filename.name in self._claimed:
+                return False
+            self._claimed.add(filename.name)
+            return True
+
+    def write_file(
+        self, filename: pathlib.Path, data: bytes, server_timestamp: str
+    ) -> None:
+        """
+        Atomically write a file and record it in the manifest.
+
+        The data is written to a uniquely named temporary file which is then
+        renamed so the file either does not exist or is complete.
+        """
+        fd, temp_filename = tempfile.mkstemp(
+            dir=filename.parent, prefix=filename.name + ".", suffix=".part"
+        )
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+
+        entry = {
+            "filename": filename.name,
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "server_timestamp": server_timestamp,
+            "downloaded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        with self._lock:
+            self._entries[filename.name] = entry
+            with open(self.path, "a") as fh:
+                fh.write(json.dumps(entry) + "\n")
+
+
+def create_session(max_connections: int) -> requests.Session:
+    """
+    Create a HTTP session with up to `max_connections` keep-alive connections
+    that retries failed requests with an exponential backoff.
+    """
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max_connections,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _copy_without_children(element: etree._Element, tag: str) -> etree._Element:
+    """
+    Deep copy of an element without its `tag` children.
+    """
+    new = etree.Element(element.tag, attrib=element.attrib, nsmap=element.nsmap)
+    new.text = element.text
+    new.extend(copy.deepcopy(_i) for _i in element if _i.tag != tag)
+    return new
+
+
+def split_stationxml(data: bytes) -> typing.Dict[typing.Tuple[str, str], bytes]:
+    """
+    Split a StationXML document into one document per station.
+
+    This works on the raw XML and does not read and write it with ObsPy -
+    its StationXML reader is tested with these files so they must be exactly
+    what the server returned. Each document has the root element and the
+    network elements with all their children, but only the station elements
+    (all epochs) of a single station.
+
+    :returns: Dictionary mapping `(network, station)` to the documents.
+    """
+    root = etree.fromstring(data)
+    namespace = etree.QName(root).namespace
+    network_tag = f"{{{namespace}}}Network" if namespace else "Network"
+    station_tag = f"{{{namespace}}}Station" if namespace else "Station"
+
+    # Network elements (there might be multiple epochs) with the station
+    # elements of every station.
+    stations = collections.defaultdict(list)
+    for network in root.iterchildren(network_tag):
+        by_code = collections.defaultdict(list)
+        for station in network.iterchildren(station_tag):
+            by_code[station.get("code")].append(station)
+        for code, elements in by_code.items():
+            stations[(network.get("code"), code)].append((network, elements))
+
+    documents = {}
+    for key, networks in stations.items():
+        new_root = _copy_without_children(root, network_tag)
+        for network, elements in networks:
+            new_network = _copy_without_children(network, station_tag)
+            new_network.extend(copy.deepcopy(_i) for _i in elements)
+            new_root.append(new_network)
+        documents[key] = etree.tostring(
+            new_root, xml_declaration=True, encoding="UTF-8"
+        )
+    return documents
+
+
+def download_stationxml_files_bulk(
+    session: requests.Session,
+    client: Client,
+    manifest: Manifest,
+    stations: typing.List[typing.Tuple[str, str, pathlib.Path]],
+    compression: typing.Optional[str] = None,
+) -> typing.List[pathlib.Path]:
+    """
+    Download the response level StationXML files of many stations with a
+    single bulk request.
+
+    :param stations: List of `(network, station, filename)` tuples. The
+        returned StationXML document is split into one file per station.
+    :param compression: Compression of the written files, see
+        `compressed_files.SUFFIXES`.
+    :returns: The filenames of the stations without any data.
+    """
+    bulk = "level=response\n" + "".join(
+        f"{network} {station} * * * *\n" for network, station, _ in stations
+    )
+    r = session.post(
+        build_url(
+            client.base_url, "station", client.major_versions["station"], "query"
+        ),
+        data=bulk.encode(),
+        timeout=TIMEOUT,
+    )
+    if r.status_code == 204:
+        return [filename for _, _, filename in stations]
+    r.raise_for_status()
+    server_timestamp = r.headers.get("Last-Modified", r.headers.get("Date"))
+    documents = split_stationxml(r.content)
+
+    missing = []
+    for network, station, filename in stations:
+        if (network, station) not in documents:
+            missing.append(filename)
+            continue
+        manifest.write_file(
+            filename,
+            compress(documents[(network, station)], compression),
+            server_timestamp,
+        )
+    return missing
+
 
 def download_stationxml_files_for_provider(
-    provider: str, output_folder: pathlib.Path
+    provider: str,
+    output_folder: pathlib.Path,
+    manifest: Manifest,
+    max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS_PER_PROVIDER,
+    bulk_size: int = BULK_SIZE,
+    compression: typing.Optional[str] = COMPRESSION,
 ) -> None:
+    """
+    Download the StationXML files of all stations of a provider that are not
+    yet completely downloaded according to the manifest.
+
+    `provider` is either a key of `URL_MAPPINGS` or the base URL of any
+    FDSN web service - e.g. a local stub server for testing.
+    """
+
     def _p(msg):
         print(f"Provider '{provider}': {msg}")
 
-    output_folder.mkdir(exist_ok=True)
-
     # Get inventory for provider.
-    client = Client(provider)
-    _p("Retrieving inventory ...")
     try:
+        client = Client(provider)
+        _p("Retrieving inventory ...")
         inv = client.get_stations(
             level="station", format="text", network=NETWORK, station=STATION
         )
@@ -45,29 +304,71 @@ def download_stationxml_files_for_provider(
     # Unique list to get rid of station epochs.
     net_sta = sorted(set(net_sta))
 
-    for _i, (network, station) in enumerate(net_sta):
-        filename = output_folder / f"{network}_{station}.xml"
-        if filename.exists():
-            _p(f"File '{filename} already exists.")
+    downloads = []
+    for network, station in net_sta:
+        filename = get_filename(output_folder / f"{network}_{station}.xml", compression)
+        if manifest.is_complete(filename, verify_checksum=VERIFY_CHECKSUMS):
             continue
-        _p(f"Downloading file {_i + 1} of {len(net_sta)}: {filename}")
-        try:
-            client.get_stations(
-                network=network,
-                station=station,
-                level="response",
-                filename=str(filename),
-            )
-        except Exception as e:
-            _p(f"Failed to download '{filename}' due to: {str(e)}")
+        # Already being downloaded from another provider.
+        if not manifest.claim(filename):
             continue
+        downloads.append((network, station, filename))
+
+    # All threads share the keep-alive connections of a single session.
+    with create_session(max_concurrent_requests) as session:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent_requests
+        ) as executor:
+            batches = [
+                downloads[_i : _i + bulk_size]
+                for _i in range(0, len(downloads), bulk_size)
+            ]
+            futures = {
+                executor.submit(
+                    download_stationxml_files_bulk,
+                    session,
+                    client,
+                    manifest,
+                    batch,
+                    compression,
+                ): batch
+                for batch in batches
+            }
+            for _i, future in enumerate(concurrent.futures.as_completed(futures)):
+                batch = futures[future]
+                try:
+                    missing = future.result()
+                except Exception as e:
+                    _p(
+                        f"Failed to download batch {_i + 1} of {len(batches)} "
+                        f"({len(batch)} stations) due to: {str(e)}"
+                    )
+                    continue
+                for filename in missing:
+                    _p(f"No data available for '{filename}'.")
+                _p(
+                    f"Downloaded batch {_i + 1} of {len(batches)}: "
+                    f"{len(batch) - len(missing)} files"
+                )
 
 
 def main():
-    for provider in PROVIDERS:
-        download_stationxml_files_for_provider(
-            provider=provider, output_folder=DATA_PATH
-        )
+    DATA_PATH.mkdir(exist_ok=True)
+    manifest = Manifest(MANIFEST_PATH)
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=MAX_CONCURRENT_PROVIDERS
+    ) as executor:
+        futures = [
+            executor.submit(
+                download_stationxml_files_for_provider,
+                provider=provider,
+                output_folder=DATA_PATH,
+                manifest=manifest,
+            )
+            for provider in PROVIDERS
+        ]
+        for future in futures:
+            future.result()
 
 
 if __name__ == "__main__":
@@ -1,16 +1,67 @@
+import collections
+import functools
+import itertools
+import json
+import os
 import pathlib
+import sys
+import typing
 
-import matplotlib.pyplot as plt
 import numpy as np
-import obspy
 from obspy.core.inventory.response import Response
 
+# The adaptive frequency grids are shared with the great response test.
+sys.path.append(
+    str(pathlib.Path(__file__).resolve().parent.parent / "the_great_response_test")
+)
+
+from compressed_files import find_stationxml_files
+from failure_report import get_plot_filename, plot_failure, write_index
+from frequency_grid import (
+    FrequencyGridCache,
+    get_adaptive_frequencies,
+    get_characteristic_frequencies,
+)
+from isolated_pool import iter_results
+from response_fingerprint import MemoizingResponseEvaluator, get_response_fingerprint
+from stationxml_stream import iter_channels
+
 CACHE_PATH = pathlib.Path("./cache")
 DATA_PATH = pathlib.Path("./data")
+# Failures of the last run as JSON lines and a summary of all results.
+FAILURES_PATH = pathlib.Path("./failures.jsonl")
+SUMMARY_PATH = pathlib.Path("./summary.json")
+# Plots of all failures and an HTML index linking to them.
+REPORT_PATH = pathlib.Path("./report")
+
+# Number of files tested at the same time. If a worker process crashes, the
+# files it might have been testing are tested again one at a time, each in its
+# own process, so only the file that crashes it is recorded as a failure.
+N_PROCESSES = os.cpu_count()
+
+# Number of channels of a file that are read and tested at a time. Limits the
+# memory usage for huge files.
+CHUNK_SIZE = 1000
+
+# Render a plot of every mismatch to a PNG file. This happens in the worker
+# that found the mismatch so it never blocks the run.
+PLOT_FAILURES = True
 
 # Number of frequencies to test at.
 N_FREQUENCIES = 100
 
+# Test on an adaptive grid that is dense around corners and notches and
+# sparse in flat passbands instead of `N_FREQUENCIES` logarithmically spaced
+# frequencies - it never has more frequencies than that. It is built from
+# `Response.get_response()` - responses it fails for use the fixed grid. Grids
+# are only built once per identical response and the values of
+# `Response.get_response()` computed while building them are compared to
+# evalresp instead of evaluating it again.
+ADAPTIVE_FREQUENCIES = True
+
+# Frequency grids of all responses tested by this process.
+GRID_CACHE = FrequencyGridCache()
+
 # TOLERANCES
 RTOL = 1e-4
 ATOL_AS_FRAC_OF_ABS_MAX = 5e-4
@@ -21,8 +72,55 @@ ATOL_AS_FRAC_OF_ABS_MAX = 5e-4
 # This will have to be expanded in the course of this test.
 SKIP_VALIDATING_PHASE_REPONSE = ["IU.AFI..UHE", "IU.AFI..UHN", "IU.AFI..UHZ"]
 
+# Identical responses (same stages, gains, and frequencies) are only evaluated
+# once per process.
+EVALUATOR = MemoizingResponseEvaluator()
+
+
+class Failure(typing.NamedTuple):
+    """
+    A response that could not be compared or that does not match evalresp.
+
+    The amplitude deviation is relative to the largest amplitude, the phase
+    deviation is in radians. Both are None if the comparison could not be
+    performed.
+    """
+
+    filename: str
+    channel_id: str
+    starttime: str
+    endtime: typing.Optional[str]
+    reason: str
+    max_amplitude_deviation: typing.Optional[float] = None
+    max_phase_deviation: typing.Optional[float] = None
+    # Path of the rendered plot of the mismatch.
+    plot: typing.Optional[str] = None
+
+
+class EvalrespError(Exception):
+    pass
+
 
-def compare_single_response(channel_id: str, response: Response):
+class FileResult(typing.NamedTuple):
+    filename: str
+    # True if it has been skipped because it already passed in an earlier
+    # run.
+    cached: bool
+    n_responses: int
+    # Responses evalresp failed to compute - these can't be compared.
+    n_evalresp_failures: int
+    failures: typing.List[Failure]
+    evaluator_hits: int
+    evaluator_misses: int
+
+
+def get_frequencies(
+    response: Response,
+) -> typing.Tuple[np.ndarray, typing.Optional[np.ndarray]]:
+    """
+    Get the frequencies to test a response at and the scipy response at them
+    if it is already known from building the grid, otherwise None.
+    """
     # detect sampling rate from response stages
     for stage in response.response_stages[::-1]:
         if (
@@ -38,21 +136,54 @@ def compare_single_response(channel_id: str, response: Response):
 
     # Compute up to the Nyquist frequency - evalresp's phase usually goes crazy
     # afterwards.
-    FREQUENCIES = np.logspace(-2, np.log10(0.5 * sampling_rate), N_FREQUENCIES)
+    if ADAPTIVE_FREQUENCIES:
+
+        try:
+            # The fingerprint includes the decimation and thus the sampling
+            # rate.
+            return GRID_CACHE.get(
+                get_response_fingerprint(response),
+                lambda: get_adaptive_frequencies(
+                    lambda f: response.get_response(f, output="VEL"),
+                    1e-2,
+                    0.5 * sampling_rate,
+                    get_characteristic_frequencies(response),
+                    max_frequencies=N_FREQUENCIES,
+                ),
+            )
+        except Exception:
+            pass
+    return np.logspace(-2, np.log10(0.5 * sampling_rate), N_FREQUENCIES), None
 
-    # Compute for evalresp as well as the scipy response.
+
+def compare_single_response(
+    channel_id: str,
+    response: Response,
+    frequencies: np.ndarray,
+    plot_filename: typing.Optional[pathlib.Path] = None,
+    values: typing.Optional[np.ndarray] = None,
+) -> typing.Optional[typing.Tuple[str, float, float, typing.Optional[str]]]:
+    """
+    Compare the scipy response to evalresp. `values` is the scipy response at
+    `frequencies` if it is already known.
+
+    Returns None if both match, otherwise a tuple of the reason, the maximum
+    amplitude and phase deviation, and the filename of the plot of both
+    responses if `plot_filename` is given. Raises if the comparison cannot be
+    performed.
+    """
+    # Compute for evalresp as well as the scipy response. Failures of evalresp
+    # are raised as an EvalrespError.
     try:
-        eval_resp = response.get_evalresp_response_for_frequencies(
-            FREQUENCIES, output="VEL"
+        eval_resp = EVALUATOR.get_evalresp_response_for_frequencies(
+            response, frequencies, output="VEL"
         )
     except Exception as e:
-        print(
-            "  evalresp failed to compute response. Thus no comparision can be"
-            f"performed. Reason for evalresp failure: {str(e)}"
-        )
-        return
+        raise EvalrespError(str(e)) from e
 
-    scipy_resp = response.get_response(FREQUENCIES, output="VEL")
+    scipy_resp = EVALUATOR.get_response(
+        response, frequencies, output="VEL", values=values
+    )
 
     # Use amplitude and phase for the comparison just because it is more
     # intuitive.
@@ -65,52 +196,40 @@ def compare_single_response(channel_id: str, response: Response):
     atol_amplitude = scipy_resp_amplitude.max() * ATOL_AS_FRAC_OF_ABS_MAX
     atol_phase = np.abs(scipy_resp_phase).max() * ATOL_AS_FRAC_OF_ABS_MAX
 
-    try:
-        np.testing.assert_allclose(
-            eval_resp_amplitude,
-            scipy_resp_amplitude,
-            rtol=RTOL,
-            atol=atol_amplitude,
-            err_msg="amplitude mismatch",
-        )
-        # Skip if manually verified.
-        if channel_id not in SKIP_VALIDATING_PHASE_REPONSE:
-            np.testing.assert_allclose(
-                eval_resp_phase,
-                scipy_resp_phase,
-                rtol=RTOL,
-                atol=atol_phase,
-                err_msg="amplitude mismatch",
-            )
-    except Exception as e:
-        print(f"Failed comparison due to: {str(e)}")
-        print("Will now produce a plot to help diagnose the issue.")
-
-        plt.subplot(411)
-        plt.title("Amplitude response")
-        plt.loglog(FREQUENCIES, eval_resp_amplitude, label="Evalresp")
-        plt.loglog(FREQUENCIES, scipy_resp_amplitude, label="scipy")
-        plt.legend()
-
-        plt.subplot(412)
-        plt.title("Amplitude response difference")
-        plt.loglog(FREQUENCIES, eval_resp_amplitude - scipy_resp_amplitude)
+    reasons = []
+    if not np.allclose(
+        eval_resp_amplitude, scipy_resp_amplitude, rtol=RTOL, atol=atol_amplitude
+    ):
+        reasons.append("amplitude mismatch")
+    # Skip if manually verified.
+    if channel_id not in SKIP_VALIDATING_PHASE_REPONSE and not np.allclose(
+        eval_resp_phase, scipy_resp_phase, rtol=RTOL, atol=atol_phase
+    ):
+        reasons.append("phase mismatch")
+    if not reasons:
+        return None
 
-        plt.subplot(413)
-        plt.title("Phase response")
-        plt.semilogx(FREQUENCIES, eval_resp_phase, label="Evalresp")
-        plt.semilogx(FREQUENCIES, scipy_resp_phase, label="scipy")
-        plt.legend()
-
-        plt.title("Phase response difference")
-        plt.subplot(414)
-        plt.semilogx(FREQUENCIES, eval_resp_phase - scipy_resp_phase)
+    if plot_filename is not None:
+        plot_failure(
+            plot_filename,
+            f"{channel_id}: {', '.join(reasons)}",
+            frequencies,
+            eval_resp,
+            scipy_resp,
+        )
 
-        plt.show()
-        raise e
+    return (
+        ", ".join(reasons),
+        float(
+            np.abs(eval_resp_amplitude - scipy_resp_amplitude).max()
+            / scipy_resp_amplitude.max()
+        ),
+        float(np.abs(eval_resp_phase - scipy_resp_phase).max()),
+        str(plot_filename) if plot_filename is not None else None,
+    )
 
 
-def test_single_stationxml_file(filename: pathlib.Path):
+def test_single_stationxml_file(filename: pathlib.Path) -> FileResult:
     def _p(msg, indent: int = 0):
         print(f"{' ' * indent}File '{filename}': {msg}")
 
@@ -119,43 +238,199 @@ def test_single_stationxml_file(filename: pathlib.Path):
     cache_file = CACHE_PATH / filename.name
     if cache_file.exists():
         _p("Already has been tested. Skipping ...", indent=2)
-        return
+        return FileResult(str(filename), True, 0, 0, [], 0, 0)
 
-    try:
-        inv = obspy.read_inventory(str(filename))
-    except Exception as e:
-        _p(f"Failed to parse due to: {str(e)}")
-        raise e
-
-    all_responses = []
-    for net in inv:
-        for sta in net:
-            for cha in sta:
-                all_responses.append(
-                    [
-                        net.code,
-                        sta.code,
-                        cha.location_code,
-                        cha.code,
-                        cha.start_date,
-                        cha.end_date,
-                        cha.response,
-                    ]
-                )
-    for _i, c in enumerate(all_responses):
+    stats = EVALUATOR.stats()
+
+    def _result(n_responses, n_evalresp_failures, failures):
+        new_stats = EVALUATOR.stats()
+        return FileResult(
+            filename=str(filename),
+            cached=False,
+            n_responses=n_responses,
+            n_evalresp_failures=n_evalresp_failures,
+            failures=failures,
+            evaluator_hits=new_stats["hits"] - stats["hits"],
+            evaluator_misses=new_stats["misses"] - stats["misses"],
+        )
+
+    failures = []
+    n_responses = 0
+    n_evalresp_failures = 0
+    # Compressed files are decompressed on the fly and the channels are read
+    # one at a time so the memory usage does not depend on the size of the
+    # file. They are tested in chunks of `CHUNK_SIZE` channels.
+    channels = iter_channels(filename)
+    while True:
+        try:
+            chunk = [
+                [
+                    net,
+                    sta,
+                    cha.location_code,
+                    cha.code,
+                    cha.start_date,
+                    cha.end_date,
+                    response,
+                ]
+                for net, sta, cha, response in itertools.islice(channels, CHUNK_SIZE)
+            ]
+        except Exception as e:
+            _p(f"Failed to parse due to: {str(e)}")
+            failures.append(
+                Failure(str(filename), "", "", None, f"Failed to parse: {e}")
+            )
+            break
+        if not chunk:
+            break
+        n_responses += len(chunk)
+        chunk_failures, chunk_evalresp_failures = _test_responses(filename, chunk, _p)
+        failures.extend(chunk_failures)
+        n_evalresp_failures += chunk_evalresp_failures
+
+    # Finally just touch the cache file so it will be skipped the next run -
+    # but only if everything passed.
+    if not failures:
+        cache_file.touch()
+
+    return _result(n_responses, n_evalresp_failures, failures)
+
+
+def _test_responses(
+    filename: pathlib.Path, all_responses: typing.List[list], _p: typing.Callable
+) -> typing.Tuple[typing.List[Failure], int]:
+    """
+    Compare a list of responses and return all failures and the number of
+    responses evalresp failed to compute.
+    """
+    # The frequencies to test every response at and the scipy response at
+    # them if already known - or the reason why they could not be determined
+    # which is reported by the comparison below.
+    all_frequencies = []
+    all_values = []
+    for c in all_responses:
+        try:
+            frequencies, values = get_frequencies(c[-1])
+        except Exception as e:
+            frequencies, values = e, None
+        all_frequencies.append(frequencies)
+        all_values.append(values)
+
+    failures = []
+    n_evalresp_failures = 0
+    for c, frequencies, values in zip(all_responses, all_frequencies, all_values):
+        channel_id = ".".join(c[:4])
         _p(f"Comparing responses for {c[:-1]} ...", indent=2)
-        compare_single_response(channel_id=".".join(c[:4]), response=c[-1])
+        failure = functools.partial(
+            Failure,
+            str(filename),
+            channel_id,
+            str(c[4]),
+            str(c[5]) if c[5] else None,
+        )
+        plot_filename = None
+        if PLOT_FAILURES:
+            plot_filename = get_plot_filename(REPORT_PATH, channel_id, str(c[4]))
+        try:
+            if isinstance(frequencies, Exception):
+                raise frequencies
+            result = compare_single_response(
+                channel_id=channel_id,
+                response=c[-1],
+                frequencies=frequencies,
+                plot_filename=plot_filename,
+                values=values,
+            )
+        except EvalrespError as e:
+            _p(
+                "evalresp failed to compute response. Thus no comparision can "
+                f"be performed. Reason for evalresp failure: {str(e)}",
+                indent=2,
+            )
+            n_evalresp_failures += 1
+            continue
+        except Exception as e:
+            _p(f"Failed to compare {channel_id} due to: {str(e)}", indent=2)
+            failures.append(failure(f"{e.__class__.__name__}: {e}"))
+            continue
+        if result is not None:
+            _p(f"Failed comparison for {channel_id} due to: {result[0]}", indent=2)
+            failures.append(failure(*result))
+
+    return failures, n_evalresp_failures
+
+
+def _failed_file_result(filename: pathlib.Path, reason: str) -> FileResult:
+    return FileResult(
+        str(filename), False, 0, 0, [Failure(str(filename), "", "", None, reason)], 0, 0
+    )
 
-    # Finally just touch the cache file so it will be skipped the next run.
-    cache_file.touch()
+
+def write_summary(results: typing.List[FileResult]) -> dict:
+    """
+    Write all failures as an HTML report and a summary of the run as JSON.
+    """
+    failures = [_j for _i in results for _j in _i.failures]
+    write_index(REPORT_PATH / "index.html", failures)
+
+    reasons = collections.Counter(_i.reason.split(":")[0] for _i in failures)
+    summary = {
+        "files": len(results),
+        "cached_files": sum(_i.cached for _i in results),
+        "failed_files": sum(bool(_i.failures) for _i in results),
+        "responses": sum(_i.n_responses for _i in results),
+        "evalresp_failures": sum(_i.n_evalresp_failures for _i in results),
+        "failures": len(failures),
+        "failure_reasons": dict(reasons.most_common()),
+        "unique_evaluations": sum(_i.evaluator_misses for _i in results),
+        "reused_evaluations": sum(_i.evaluator_hits for _i in results),
+    }
+    with open(SUMMARY_PATH, "w") as fh:
+        json.dump(summary, fh, indent=4)
+    return summary
 
 
 def main():
     CACHE_PATH.mkdir(exist_ok=True)
-    all_files = list(DATA_PATH.glob("*.xml"))
-    for _i, filename in enumerate(all_files):
-        print(f"Reading StationXML file {_i + 1} of {len(all_files)}: {filename}")
-        test_single_stationxml_file(filename)
+    all_files = find_stationxml_files(DATA_PATH)
+
+    results = []
+    # Failures are written as soon as a file has been tested so they are not
+    # lost if the run is interrupted.
+    with open(FAILURES_PATH, "w") as fh:
+        file_results = iter_results(
+            test_single_stationxml_file, all_files, N_PROCESSES, _failed_file_result
+        )
+        for _i, result in enumerate(file_results):
+            print(
+                f"Tested StationXML file {_i + 1} of {len(all_files)}: "
+                f"{result.filename} ({len(result.failures)} failures)"
+            )
+            for failure in result.failures:
+                fh.write(json.dumps(failure._asdict()) + "\n")
+            fh.flush()
+            results.append(result)
+
+    summary = write_summary(results)
+    print()
+    print(
+        f"Tested {summary['responses']} responses in {summary['files']} files "
+        f"({summary['cached_files']} cached)."
+    )
+    print(
+        f"{summary['failures']} failures in {summary['failed_files']} files, "
+        f"evalresp failed for {summary['evalresp_failures']} responses."
+    )
+    for reason, count in summary["failure_reasons"].items():
+        print(f"  {count:6d}: {reason}")
+    print(
+        f"Evaluated {summary['unique_evaluations']} unique responses, reused "
+        f"{summary['reused_evaluations']} evaluations."
+    )
+    print(
+        f"Failures written to '{FAILURES_PATH}' and "
+        f"'{REPORT_PATH / 'index.html'}', summary to '{SUMMARY_PATH}'."
+    )
 
 
 if __name__ == "__main__":
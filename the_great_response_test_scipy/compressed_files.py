@@ -0,0 +1,72 @@
+"""
+Transparently compressed StationXML files.
+
+Response level StationXML files are highly redundant so they compress very
+well. Files are compressed with gzip or zstd (if the optional `zstandard`
+package is installed) and the compression is detected from the file suffix
+when reading them again. Decompression is streaming so the uncompressed file
+never has to fit in memory.
+"""
+
+import gzip
+import pathlib
+import typing
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File suffix for every supported compression.
+SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _check_compression(compression: typing.Optional[str]) -> None:
+    if compression not in SUFFIXES:
+        raise ValueError(
+            f"Unknown compression '{compression}'. Must be one of "
+            f"{', '.join(str(_i) for _i in SUFFIXES)}."
+        )
+    if compression == "zstd" and zstandard is None:
+        raise ImportError("zstd compression requires the 'zstandard' package.")
+
+
+def get_filename(
+    filename: pathlib.Path, compression: typing.Optional[str]
+) -> pathlib.Path:
+    """
+    Get the filename of the compressed version of a file.
+    """
+    _check_compression(compression)
+    return filename.with_name(filename.name + SUFFIXES[compression])
+
+
+def compress(data: bytes, compression: typing.Optional[str]) -> bytes:
+    _check_compression(compression)
+    if compression == "gzip":
+        return gzip.compress(data)
+    elif compression == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def open_file(filename: pathlib.Path) -> typing.BinaryIO:
+    """
+    Open a possibly compressed file for reading. Compressed files are
+    decompressed on the fly.
+    """
+    if filename.suffix == SUFFIXES["gzip"]:
+        return gzip.open(filename, "rb")
+    elif filename.suffix == SUFFIXES["zstd"]:
+        _check_compression("zstd")
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"))
+    return open(filename, "rb")
+
+
+def find_stationxml_files(folder: pathlib.Path) -> typing.List[pathlib.Path]:
+    """
+    Find all compressed and uncompressed StationXML files in a folder.
+    """
+    return sorted(
+        _i for suffix in SUFFIXES.values() for _i in folder.glob(f"*.xml{suffix}")
+    )
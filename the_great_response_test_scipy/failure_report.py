@@ -0,0 +1,105 @@
+"""
+Headless report of all failed comparisons.
+
+Every mismatch is rendered to a PNG file by the process that found it and an
+HTML index of all failures links to the plots. Nothing is ever shown
+interactively so unattended runs never block. matplotlib is only imported
+once the first plot is rendered which keeps it out of the startup time of
+processes that don't find any failures.
+"""
+
+import html
+import pathlib
+import re
+import typing
+
+import numpy as np
+
+
+def get_plot_filename(folder: pathlib.Path, *parts: str) -> pathlib.Path:
+    """
+    A filename for the plot of a failure that is safe on all file systems.
+    """
+    return folder / (re.sub(r"[^\w.-]", "_", "_".join(parts)) + ".png")
+
+
+def plot_failure(
+    filename: pathlib.Path,
+    title: str,
+    frequencies: np.ndarray,
+    eval_resp: np.ndarray,
+    scipy_resp: np.ndarray,
+):
+    """
+    Render amplitude and phase of both responses and their differences to a
+    PNG file.
+    """
+    # Use the Agg canvas directly - this does not need a display and does not
+    # touch the global pyplot state.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    eval_resp_amplitude = np.abs(eval_resp)
+    eval_resp_phase = np.angle(eval_resp)
+
+    scipy_resp_amplitude = np.abs(scipy_resp)
+    scipy_resp_phase = np.angle(scipy_resp)
+
+    fig = Figure(figsize=(10, 12))
+    FigureCanvasAgg(fig)
+    fig.suptitle(title)
+    ax1, ax2, ax3, ax4 = fig.subplots(4, 1, sharex=True)
+
+    ax1.set_title("Amplitude response")
+    ax1.loglog(frequencies, eval_resp_amplitude, label="Evalresp")
+    ax1.loglog(frequencies, scipy_resp_amplitude, label="scipy")
+    ax1.legend()
+
+    ax2.set_title("Amplitude response difference")
+    ax2.loglog(frequencies, np.abs(eval_resp_amplitude - scipy_resp_amplitude))
+
+    ax3.set_title("Phase response")
+    ax3.semilogx(frequencies, eval_resp_phase, label="Evalresp")
+    ax3.semilogx(frequencies, scipy_resp_phase, label="scipy")
+    ax3.legend()
+
+    ax4.set_title("Phase response difference")
+    ax4.semilogx(frequencies, eval_resp_phase - scipy_resp_phase)
+    ax4.set_xlabel("Frequency [Hz]")
+
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(filename, dpi=80)
+
+
+def write_index(filename: pathlib.Path, failures: typing.List[typing.NamedTuple]):
+    """
+    Write an HTML page with a table of all failures. Failures with a plot
+    link to it - the plots have to be in the same folder or below.
+    """
+    fields = [_i for _i in failures[0]._fields if _i != "plot"] if failures else []
+    rows = []
+    for failure in failures:
+        cells = "".join(
+            f"<td>{html.escape(str(getattr(failure, _i)))}</td>" for _i in fields
+        )
+        plot = getattr(failure, "plot", None)
+        if plot:
+            link = html.escape(
+                pathlib.Path(plot).relative_to(filename.parent).as_posix()
+            )
+            cells += f'<td><a href="{link}"><img src="{link}" width="200"></a></td>'
+        else:
+            cells += "<td></td>"
+        rows.append(f"<tr>{cells}</tr>")
+
+    header = "".join(f"<th>{html.escape(_i)}</th>" for _i in fields + ["plot"])
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    with open(filename, "w") as fh:
+        fh.write(
+            "<!DOCTYPE html>\n<html>\n<head>\n<meta charset='utf-8'>\n"
+            f"<title>Response test failures</title>\n</head>\n<body>\n"
+            f"<h1>{len(failures)} failures</h1>\n"
+            f"<table border='1'>\n<tr>{header}</tr>\n"
+            + "\n".join(rows)
+            + "\n</table>\n</body>\n</html>\n"
+        )
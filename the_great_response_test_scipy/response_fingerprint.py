@@ -0,0 +1,176 @@
+"""
+Fingerprints of responses and a memoizing response evaluator.
+
+Real networks reuse the same sensor/datalogger combinations across hundreds
+of channels and epochs. The fingerprint is a stable hash over everything that
+determines the values of a response so identical responses are only
+evaluated once.
+"""
+
+import hashlib
+import typing
+
+import numpy as np
+from obspy.core.inventory.response import Response
+
+from lru_cache import LRUCache
+
+# All response stage attributes that influence the response values. Missing
+# ones are ignored so this covers all stage types.
+_STAGE_ATTRIBUTES = (
+    "stage_sequence_number",
+    "stage_gain",
+    "stage_gain_frequency",
+    "input_units",
+    "output_units",
+    "decimation_input_sample_rate",
+    "decimation_factor",
+    "decimation_offset",
+    "decimation_delay",
+    "decimation_correction",
+    # PolesZerosResponseStage
+    "pz_transfer_function_type",
+    "normalization_frequency",
+    "normalization_factor",
+    "zeros",
+    "poles",
+    # CoefficientsTypeResponseStage
+    "cf_transfer_function_type",
+    "numerator",
+    "denominator",
+    # FIRResponseStage
+    "symmetry",
+    "coefficients",
+    # ResponseListResponseStage
+    "response_list_elements",
+    # PolynomialResponseStage
+    "approximation_type",
+    "frequency_lower_bound",
+    "frequency_upper_bound",
+    "approximation_lower_bound",
+    "approximation_upper_bound",
+    "maximum_error",
+)
+
+_SENSITIVITY_ATTRIBUTES = ("value", "frequency", "input_units", "output_units")
+
+
+def _normalize(value):
+    """
+    Convert a value to a representation with a stable repr() dropping
+    uncertainties and other metadata.
+    """
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value)
+    if isinstance(value, (complex, np.complexfloating)):
+        return complex(value)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_normalize(_i) for _i in value)
+    # Response list elements.
+    if hasattr(value, "frequency") and hasattr(value, "amplitude"):
+        return tuple(
+            _normalize(getattr(value, _i)) for _i in ("frequency", "amplitude", "phase")
+        )
+    return str(value)
+
+
+def get_response_fingerprint(response: Response) -> str:
+    """
+    Get a stable hash over all stages, gains, and the sensitivity of a
+    response.
+    """
+    items = []
+    for stage in response.response_stages:
+        items.append(stage.__class__.__name__)
+        items.extend(
+            (_i, _normalize(getattr(stage, _i)))
+            for _i in _STAGE_ATTRIBUTES
+            if hasattr(stage, _i)
+        )
+    for name in ("instrument_sensitivity", "instrument_polynomial"):
+        obj = getattr(response, name, None)
+        if obj is None:
+            continue
+        items.append(name)
+        items.extend(
+            (_i, _normalize(getattr(obj, _i)))
+            for _i in _SENSITIVITY_ATTRIBUTES + _STAGE_ATTRIBUTES
+            if hasattr(obj, _i)
+        )
+    return hashlib.sha256(repr(items).encode()).hexdigest()
+
+
+def get_frequencies_fingerprint(frequencies: np.ndarray) -> str:
+    return hashlib.sha256(
+        np.ascontiguousarray(frequencies, dtype=np.float64).tobytes()
+    ).hexdigest()
+
+
+class MemoizingResponseEvaluator:
+    """
+    Evaluates responses and remembers the results for the last `maxsize`
+    combinations of response fingerprint, frequencies, output, and method.
+
+    Failures are remembered as well and raised again for identical responses.
+    The returned arrays are shared and thus read-only.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self._cache = LRUCache(maxsize)
+
+    def get_evalresp_response_for_frequencies(
+        self, response: Response, frequencies: np.ndarray, output: str
+    ) -> np.ndarray:
+        return self._evaluate(
+            "get_evalresp_response_for_frequencies", response, frequencies, output
+        )
+
+    def get_response(
+        self,
+        response: Response,
+        frequencies: np.ndarray,
+        output: str,
+        values: typing.Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        `values` is the already known (read-only) result of
+        `response.get_response(frequencies, output=output)`. It is remembered
+        instead of evaluating the response again.
+        """
+        return self._evaluate("get_response", response, frequencies, output, values)
+
+    def _get_key(
+        self, method: str, response: Response, frequencies: np.ndarray, output: str
+    ) -> tuple:
+        return (
+            method,
+            get_response_fingerprint(response),
+            get_frequencies_fingerprint(frequencies),
+            output,
+        )
+
+    def _evaluate(
+        self,
+        method: str,
+        response: Response,
+        frequencies: np.ndarray,
+        output: str,
+        values: typing.Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        def _build():
+            if values is not None:
+                return values
+            result = np.asarray(getattr(response, method)(frequencies, output=output))
+            result.flags.writeable = False
+            return result
+
+        return self._cache.get(
+            self._get_key(method, response, frequencies, output), _build
+        )
+
+    def stats(self) -> typing.Dict[str, int]:
+        return self._cache.stats()
@@ -0,0 +1,80 @@
+"""
+Stream the channels of large StationXML files.
+
+`obspy.read_inventory()` builds the whole XML tree and the complete object
+graph of an inventory in memory which does not fit into the memory of a
+worker for provider-wide files with hundreds of thousands of channels. Here
+the file is parsed incrementally and each channel is converted with ObsPy's
+StationXML reader as soon as it is complete. Its XML subtree is freed right
+afterwards so only a single channel is in memory at any time.
+"""
+
+import typing
+import warnings
+
+from lxml import etree
+from obspy.core.inventory import Channel
+from obspy.core.inventory.response import Response
+from obspy.io.stationxml.core import _read_channel
+
+from compressed_files import open_file
+
+# StationXML namespace - the same for all versions of the format.
+NAMESPACE = "http://www.fdsn.org/xml/station/1"
+
+# Elements the parser stops at - everything else is handled by ObsPy.
+_LEVELS = ("Network", "Station", "Channel")
+
+
+def _ns(tagname: str) -> str:
+    return f"{{{NAMESPACE}}}{tagname}"
+
+
+def _free(element: etree._Element):
+    """
+    Free an element that has been dealt with and all of its preceding
+    siblings.
+    """
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
+def iter_channels(
+    filename,
+) -> typing.Iterator[typing.Tuple[str, str, Channel, typing.Optional[Response]]]:
+    """
+    Iterate over all channels of a possibly compressed StationXML file.
+
+    Yields tuples of the network code, the station code, the channel, and its
+    response. Channels without a complete set of coordinates can't be read by
+    ObsPy and are skipped with a warning, just like `obspy.read_inventory()`
+    does.
+    """
+    network = station = None
+    with open_file(filename) as fh:
+        for event, element in etree.iterparse(
+            fh, events=("start", "end"), tag=[_ns(_i) for _i in _LEVELS]
+        ):
+            if event == "start":
+                # The codes are attributes so they are already known at the
+                # start of the element.
+                if element.tag == _ns("Network"):
+                    network = element.get("code")
+                elif element.tag == _ns("Station"):
+                    station = element.get("code")
+                continue
+
+            if element.tag == _ns("Channel"):
+                channel = _read_channel(element, _ns, level="response")
+                if channel is None:
+                    warnings.warn(
+                        f"Channel {network}.{station}."
+                        f"{element.get('locationCode')}.{element.get('code')} "
+                        "does not have a complete set of coordinates and "
+                        "cannot be read. It will be skipped.",
+                        UserWarning,
+                    )
+                else:
+                    yield network, station, channel, channel.response
+            _free(element)